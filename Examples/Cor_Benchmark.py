@@ -0,0 +1,84 @@
+'''
+Compare time and peak memory of pest_tools.Cor with the original
+calculation (pest_tools <= 0.1.4), which formed the nobs x nobs weight
+matrix q
+
+Each calculation runs in its own process so its peak resident set size
+(RSS) can be measured with the resource module.
+
+Usage:
+    python Cor_Benchmark.py [nobs] [npar]
+
+The original calculation needs 2 x 8 x nobs**2 bytes for q alone (3.2 GB
+for 10000 observations), so keep nobs modest
+'''
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pest_tools as pt
+
+def cor_with_q(jco_df, res_df):
+    ''' Original covariance calculation, kept here as the reference '''
+    pars = jco_df.columns.values
+    phi = sum(res_df['Weighted Residual']**2)
+    weights = res_df['Weight'].values
+    q = np.diag(np.diag(np.tile(weights**2, (len(weights), 1))))
+    x = jco_df.values
+    cov = np.dot((phi/(np.count_nonzero(weights)-len(pars))),
+                 (np.linalg.inv(np.dot(np.dot(x.T, q),x))))
+    return pd.DataFrame(cov, index = pars, columns = pars)
+
+def synthetic_problem(nobs, npar):
+    ''' Random Jacobian and residuals with the columns of pest_tools.Res '''
+    rng = np.random.RandomState(0)
+    obs_names = ['ob%d' % (i) for i in range(nobs)]
+    jco_df = pd.DataFrame(rng.standard_normal((nobs, npar)), index = obs_names,
+                          columns = ['par%d' % (i) for i in range(npar)])
+    weights = rng.random_sample(nobs)
+    res_df = pd.DataFrame({'Weight' : weights,
+                           'Weighted Residual' : weights * rng.standard_normal(nobs)},
+                          index = obs_names)
+    return jco_df, res_df
+
+def peak_rss_mb():
+    ''' Peak resident set size of this process in MB (ru_maxrss is in kB
+    on Linux) '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def run(method, nobs, npar):
+    ''' Run one calculation and print time, peak RSS and a checksum '''
+    jco_df, res_df = synthetic_problem(nobs, npar)
+    baseline = peak_rss_mb()
+    start = time.time()
+    if method == 'before':
+        cov_df = cor_with_q(jco_df, res_df)
+    else:
+        cov_df = pt.Cor(jco_df, res_df).cov_df
+    elapsed = time.time() - start
+    print '%r %r %r %r' % (elapsed, peak_rss_mb(), baseline, cov_df.values.sum())
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'run':
+        run(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+        sys.exit()
+
+    nobs = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    npar = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    print 'Synthetic Jacobian: %d obs x %d pars' % (nobs, npar)
+    results = dict()
+    for method in ['before', 'after']:
+        output = subprocess.check_output([sys.executable, __file__, 'run', method,
+                                          str(nobs), str(npar)])
+        results[method] = [float(value) for value in output.split()]
+
+    t_before, rss_before, base_before, check_before = results['before']
+    t_after, rss_after, base_after, check_after = results['after']
+    assert np.allclose(check_before, check_after, rtol = 1e-8)
+    print 'Weight matrix q: %8.2f s  peak RSS %8.1f MB (%8.1f MB above inputs)' % (
+        t_before, rss_before, rss_before - base_before)
+    print 'Scaled rows:     %8.2f s  peak RSS %8.1f MB (%8.1f MB above inputs)' % (
+        t_after, rss_after, rss_after - base_after)
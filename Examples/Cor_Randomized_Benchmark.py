@@ -0,0 +1,59 @@
+'''
+Compare the randomized solver of pest_tools.Cor, which computes only the
+leading n_eig eigenpairs of J^T Q J, with the full eigen-decomposition
+
+The synthetic Jacobian has singular values decaying over six orders of
+magnitude, as from a highly parameterized model.  The randomized solver
+is accurate when the n_eig leading eigenvalues stand out from the rest;
+the error grows for small n_eig on a flat spectrum
+
+Usage:
+    python Cor_Randomized_Benchmark.py [nobs] [npar] [n_eig]
+'''
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pest_tools as pt
+
+def synthetic_problem(nobs, npar):
+    ''' Jacobian with singular values logspace(3, -3) and unit weights,
+    returned with its singular values and right singular vectors '''
+    rng = np.random.RandomState(1)
+    u = np.linalg.qr(rng.standard_normal((nobs, npar)))[0]
+    v = np.linalg.qr(rng.standard_normal((npar, npar)))[0]
+    s = np.logspace(3, -3, npar)
+    obs_names = ['ob%d' % (i) for i in range(nobs)]
+    jco_df = pd.DataFrame(np.dot(u * s, v.T), index = obs_names,
+                          columns = ['par%d' % (i) for i in range(npar)])
+    res_df = pd.DataFrame({'Weight' : np.ones(nobs),
+                           'Weighted Residual' : rng.standard_normal(nobs)},
+                          index = obs_names)
+    return jco_df, res_df, s, v
+
+if __name__ == '__main__':
+    nobs = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    npar = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    n_eig = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    jco_df, res_df, s, v = synthetic_problem(nobs, npar)
+    print 'Synthetic Jacobian: %d obs x %d pars, %d eigenpairs' % (nobs, npar, n_eig)
+
+    start = time.time()
+    full = pt.Cor(jco_df, res_df, solver = 'eigh')
+    t_full = time.time() - start
+
+    start = time.time()
+    randomized = pt.Cor(jco_df, res_df, solver = 'randomized', n_eig = n_eig)
+    t_randomized = time.time() - start
+
+    # Exact covariance of the n_eig best determined parameter combinations
+    scale = (res_df['Weighted Residual']**2).sum() / (nobs - npar)
+    v_k = v[:, :n_eig]
+    low_rank = scale * np.dot(v_k / s[:n_eig]**2, v_k.T)
+
+    print 'Full eigh:  %8.2f s' % (t_full)
+    print 'Randomized: %8.2f s' % (t_randomized)
+    print 'Largest relative error, eigenvalues %.1e, low-rank covariance %.1e' % (
+        np.max(np.abs(randomized.eig_values - full.eig_values[:n_eig]) / randomized.eig_values),
+        np.abs(randomized.cov_df.values - low_rank).max() / np.abs(low_rank).max())
@@ -0,0 +1,69 @@
+'''
+Compare records per second of the per-record struct.unpack .jco reader
+(pest_tools <= 0.1.4) with the bulk reader now used by pest_tools.load_jco
+
+Usage:
+    python Load_JCO_Benchmark.py [nobs] [npar]
+'''
+import os
+import struct
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pest_tools as pt
+
+def load_jco_per_record(file_name):
+    ''' Original per-record reader, kept here as the reference '''
+    f = open(file_name,'rb')
+    npar = abs(struct.unpack('i', f.read(4))[0])
+    nobs = abs(struct.unpack('i', f.read(4))[0])
+    count = abs(struct.unpack('i', f.read(4))[0])
+    x = np.zeros((nobs, npar))
+    for record in range(count):
+        j = struct.unpack('i', f.read(4))[0]
+        col = ((j-1) // nobs) + 1
+        row = j - ((col - 1) * nobs)
+        data = struct.unpack('d', f.read(8))[0]
+        x[row-1, col-1] = data
+    par_names = []
+    for i in range(npar):
+        par_names.append(struct.unpack('12s', f.read(12))[0].strip().lower())
+    obs_names = []
+    for i in range(nobs):
+        obs_names.append(struct.unpack('20s', f.read(20))[0].strip().lower())
+    f.close()
+    return x, par_names, obs_names
+
+def write_synthetic_jco(file_name, nobs, npar, density = 0.5):
+    ''' Write a random Jacobian in PEST's binary layout '''
+    rng = np.random.RandomState(0)
+    x = rng.standard_normal((nobs, npar))
+    x[rng.random_sample((nobs, npar)) > density] = 0.0
+    pt.write_jco(x, file_name, ['par%d' % (i) for i in range(npar)],
+                 ['ob%d' % (i) for i in range(nobs)])
+    return np.count_nonzero(x)
+
+if __name__ == '__main__':
+    nobs = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    npar = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    file_name = os.path.join(tempfile.mkdtemp(), 'benchmark.jco')
+    count = write_synthetic_jco(file_name, nobs, npar)
+    print 'Synthetic Jacobian: %d obs x %d pars, %d records' % (nobs, npar, count)
+
+    start = time.time()
+    x, par_names, obs_names = load_jco_per_record(file_name)
+    t_before = time.time() - start
+
+    start = time.time()
+    jco_df, new_par_names, new_obs_names = pt.load_jco(file_name)
+    t_after = time.time() - start
+
+    assert np.array_equal(jco_df.values, x)
+    assert new_par_names == par_names and new_obs_names == obs_names
+
+    print 'Per-record reader: %8.2f s  %12.0f records/s' % (t_before, count / t_before)
+    print 'Bulk reader:       %8.2f s  %12.0f records/s' % (t_after, count / t_after)
+    print 'Speedup: %.0fx' % (t_before / t_after)
+    os.remove(file_name)
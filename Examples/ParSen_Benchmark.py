@@ -0,0 +1,108 @@
+'''
+Compare the per-observation, per-column ParSen loop (pest_tools <= 0.1.4)
+with the vectorized weighted column norms now used by pest_tools.ParSen
+
+Usage:
+    python ParSen_Benchmark.py [nobs] [npar]
+
+The default 50000 x 5000 Jacobian needs about 2 GB of memory
+'''
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pest_tools as pt
+
+def par_sen_loop(jco_df, obs_dict, pars_dict, drop_regul = False,
+                 drop_groups = None, keep_groups = None):
+    ''' Original ParSen calculation, kept here as the reference '''
+    # Build weights array
+    weights = []
+    ob_groups = []
+    for ob in jco_df.index:
+        weight = float(obs_dict[ob][1])
+        ob_group = obs_dict[ob][2]
+
+        # Set weights for regularization info to zero if drop_regul == True
+        if drop_regul == True and 'regul' in ob_group.lower():
+            weight = 0.0
+
+        # Set weights for obs in drop_groups to zero
+        if drop_groups != None:
+            # set all groups in drop_groups to lower case
+            drop_groups = [item.lower() for item in drop_groups]
+            if ob_group.lower() in drop_groups:
+                weight = 0.0
+
+        # Set weights for obs not in keep_group to zero
+        if keep_groups != None:
+            # set all groups in keep_groups to lower case
+            keep_groups = [item.lower() for item in keep_groups]
+            if ob_group.lower() not in keep_groups:
+                weight = 0.0
+
+        weights.append(weight)
+        ob_groups.append(ob_group)
+
+    # Get count of non-zero weights
+    n_nonzero_weights = np.count_nonzero(weights)
+
+    # Calculate sensitivities
+    sensitivities = []
+    for col in jco_df:
+        sen = np.linalg.norm(np.asarray(jco_df[col])*weights)/n_nonzero_weights
+        sensitivities.append(sen)
+
+    # Build Group Array
+    par_groups = []
+    for par in jco_df.columns:
+        par_group = pars_dict[par][5]
+        par_groups.append(par_group)
+
+    # Build pandas data frame of parameter sensitivities
+    sen_data = {'Sensitivity' : sensitivities, 'Parameter Group' : par_groups}
+    return pd.DataFrame(sen_data, index = jco_df.columns)
+
+def synthetic_problem(nobs, npar, n_groups = 10):
+    ''' Random Jacobian with load_obs and load_pars style dictionaries '''
+    rng = np.random.RandomState(0)
+    obs_names = ['ob%d' % (i) for i in range(nobs)]
+    par_names = ['par%d' % (i) for i in range(npar)]
+    ob_groups = ['group%d' % (i) for i in range(n_groups - 1)] + ['regul_pars']
+    obs_dict = dict()
+    for i, ob in enumerate(obs_names):
+        obs_dict[ob] = ('0.0', repr(rng.random_sample()),
+                        ob_groups[i % n_groups])
+    pars_dict = dict()
+    for i, par in enumerate(par_names):
+        pars_dict[par] = ('log', 'factor', '1.0', '1e-3', '1e3',
+                          'pg%d' % (i % 5), '1.0', '0.0', '1')
+    jco_df = pd.DataFrame(rng.standard_normal((nobs, npar)),
+                          index = obs_names, columns = par_names)
+    return jco_df, obs_dict, pars_dict
+
+if __name__ == '__main__':
+    nobs = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    npar = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    jco_df, obs_dict, pars_dict = synthetic_problem(nobs, npar)
+    print 'Synthetic Jacobian: %d obs x %d pars' % (nobs, npar)
+    kwargs = {'drop_regul' : True, 'drop_groups' : ['GROUP1']}
+
+    start = time.time()
+    before = par_sen_loop(jco_df, obs_dict, pars_dict, **kwargs)
+    t_before = time.time() - start
+
+    start = time.time()
+    after = pt.ParSen(jco_df, obs_dict, pars_dict, **kwargs).df
+    t_after = time.time() - start
+
+    assert list(after.index) == list(before.index)
+    assert list(after['Parameter Group']) == list(before['Parameter Group'])
+    max_rel_diff = np.max(np.abs(after['Sensitivity'].values - before['Sensitivity'].values)
+                          / before['Sensitivity'].values)
+    assert max_rel_diff < 1e-12
+
+    print 'Loop:       %8.2f s' % (t_before)
+    print 'Vectorized: %8.2f s' % (t_after)
+    print 'Speedup: %.0fx, largest relative difference %.1e' % (t_before / t_after, max_rel_diff)
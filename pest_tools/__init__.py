@@ -1,9 +1,12 @@
 # pest-tools __int__.py
-from load_jco import load_jco
+from load_jco import load_jco, load_jcos, jco_info, iter_jco
+from jco_cache import JcoCache
+from write_jco import write_jco
 from ob_sen import ObSen
 from par_sen import ParSen
 from load_obs import load_obs
 from load_pars import load_pars
+from pst import Pst, iter_pst_obs, load_par_file
 from rmr import RMR
 from jactest import JacTest
 from identpar import Identpar
@@ -0,0 +1,361 @@
+''' Helpers used by ParSen, ObSen and Cor to work with the different forms a
+Jacobian can take (pandas DataFrame, numpy array or memmap, scipy.sparse
+matrix, or an iterable of blocks of rows)
+'''
+import numpy as np
+import pandas as pd
+
+def is_sparse(jco):
+    ''' Return True if jco is a scipy.sparse matrix '''
+    try:
+        import scipy.sparse
+    except ImportError:
+        return False
+    return scipy.sparse.issparse(jco)
+
+def is_row_blocks(jco):
+    ''' Return True if jco is an iterable of row blocks rather than a matrix '''
+    return not (isinstance(jco, (pd.DataFrame, np.ndarray)) or is_sparse(jco))
+
+def jco_names(jco, par_names = None, obs_names = None):
+    ''' Return lists of the parameter and observation names of jco
+
+    Names are taken from the columns and index of a DataFrame.  Any other
+    Jacobian needs par_names and obs_names as returned by
+    pest_tools.load_jco
+    '''
+    if isinstance(jco, pd.DataFrame):
+        if par_names is None:
+            par_names = list(jco.columns)
+        if obs_names is None:
+            obs_names = list(jco.index)
+    if par_names is None or obs_names is None:
+        raise ValueError('par_names and obs_names are required when the '
+                         'Jacobian is not a pandas DataFrame')
+    if is_row_blocks(jco):
+        # Shape is checked as the blocks are read
+        return list(par_names), list(obs_names)
+    if jco.shape != (len(obs_names), len(par_names)):
+        raise ValueError('Jacobian shape %s does not match %d observation '
+                         'and %d parameter names'
+                         % (jco.shape, len(obs_names), len(par_names)))
+    return list(par_names), list(obs_names)
+
+def canonical_csc(jco):
+    ''' CSC matrix of jco with sorted indices and no duplicate entries.  
+    jco itself is never modified, it is copied if it needs changing '''
+    csc = jco.tocsc()
+    if not csc.has_canonical_format:
+        if csc is jco:
+            csc = csc.copy()
+        csc.sum_duplicates()
+    return csc
+
+def _sparse_squared(jco):
+    ''' Element-wise square of a sparse matrix, computed in float64 '''
+    sq = canonical_csc(jco)
+    return sq.__class__((np.asarray(sq.data, dtype = np.float64)**2, 
+                         sq.indices, sq.indptr), shape = sq.shape)
+
+def sparse_group_col_sumsq(jco, weights, codes, n_groups):
+    ''' Sum over the observations of each group of (weight * Jacobian)**2
+    for each parameter, returned as an n_groups x npar array
+
+    Only the stored entries of the sparse matrix jco are touched.  Sums are
+    accumulated in float64 whatever the dtype of jco
+    '''
+    import scipy.sparse
+    weights_sq = np.asarray(weights, dtype = np.float64)**2
+    # Observation x group matrix of squared weights
+    groups = scipy.sparse.csr_matrix((weights_sq, (np.arange(len(codes)), codes)),
+                                     shape = (len(codes), n_groups))
+    return np.asarray(_sparse_squared(jco).T.dot(groups).todense()).T
+
+def sparse_row_sumsq(jco):
+    ''' Sum over parameters of Jacobian**2 for each observation
+
+    Only the stored entries of the sparse matrix jco are touched.  Sums are
+    accumulated in float64 whatever the dtype of jco
+    '''
+    return np.asarray(_sparse_squared(jco).sum(axis = 1)).ravel()
+
+def dense_values(jco):
+    ''' The 2-D array of a DataFrame or array Jacobian, without copying '''
+    if isinstance(jco, pd.DataFrame):
+        return jco.values
+    return jco
+
+def _default_block_rows(npar):
+    ''' Rows in a block of about 256k entries (2 MB of float64), small
+    enough to stay in cache while it is worked on '''
+    return max(1, 2**18 // max(npar, 1))
+
+def _stream_blocks(blocks, nobs):
+    ''' Yield (row positions, block) for an iterable of row blocks, checking
+    that they hold nobs rows in all '''
+    start = 0
+    npar = None
+    for block in blocks:
+        if isinstance(block, pd.DataFrame):
+            block = block.values
+        if npar is None:
+            npar = block.shape[1]
+        if block.shape[1] != npar or start + block.shape[0] > nobs:
+            raise ValueError('Row block of shape %s does not fit a Jacobian of '
+                             '%d observations and %d parameters'
+                             % (block.shape, nobs, npar))
+        yield np.arange(start, start + block.shape[0]), block
+        start += block.shape[0]
+    if start != nobs:
+        raise ValueError('Row blocks hold %d observations, expected %d'
+                         % (start, nobs))
+
+def _slice_blocks(x, block_rows):
+    ''' Yield (row positions, block) over consecutive blocks of rows of x '''
+    nobs = x.shape[0]
+    for start in range(0, nobs, block_rows):
+        yield np.arange(start, min(start + block_rows, nobs)), x[start:start + block_rows]
+
+def _squared(block, buffer):
+    ''' Square of a dense or sparse block in float64, in buffer if it fits.
+    Returns the square and the (possibly new) buffer '''
+    if buffer is None or buffer.shape[0] < block.shape[0] or buffer.shape[1] != block.shape[1]:
+        buffer = np.empty(block.shape, dtype = np.float64)
+    sq = buffer[:block.shape[0]]
+    if is_sparse(block):
+        # Copy into the float64 buffer and square in place
+        sq[...] = block.toarray()
+        sq *= sq
+    else:
+        # One pass, squared in float64
+        np.multiply(block, block, out = sq, dtype = np.float64)
+    return sq, buffer
+
+# Most groups in a block reduced with one gemm as they come.  The gemm
+# costs about one gemv per group, so blocks of rows with more groups are
+# read in group order instead
+_max_block_groups = 2
+
+def _group_ordered_blocks(x, codes, block_rows):
+    ''' Yield (row positions, block) over x with the rows of each window of
+    block_rows * groups consecutive rows in group order, so each block
+    holds one or two groups and x is still read window by window '''
+    nobs = x.shape[0]
+    window = block_rows * len(np.unique(codes))
+    for window_start in range(0, nobs, window):
+        rows = window_start + np.argsort(codes[window_start:window_start + window],
+                                         kind = 'mergesort')
+        for start in range(0, len(rows), block_rows):
+            yield rows[start:start + block_rows], x[rows[start:start + block_rows]]
+
+def dense_group_col_sumsq(jco, weights, codes, n_groups, block_rows = None):
+    ''' Sum over the observations of each group of (weight * Jacobian)**2
+    for each parameter, returned as an n_groups x npar array
+
+    jco may be a DataFrame, array or memmap, read block_rows rows at a time,
+    or an iterable of row blocks (dense or sparse, in observation order)
+    read once as they come.  Each block is reduced to its groups with one
+    small gemm.  Sums are accumulated in float64 whatever the dtype of jco
+    '''
+    x = dense_values(jco)
+    weights_sq = np.asarray(weights, dtype = np.float64)**2
+    codes = np.asarray(codes)
+    nobs = len(weights_sq)
+    npar = None
+    if is_row_blocks(x):
+        blocks = _stream_blocks(x, nobs)
+    else:
+        npar = x.shape[1]
+        if block_rows is None:
+            block_rows = _default_block_rows(npar)
+        n_runs = 1 + np.count_nonzero(codes[1:] != codes[:-1])
+        if (n_runs > nobs // block_rows + n_groups
+            and len(np.unique(codes[:block_rows])) > _max_block_groups):
+            # Groups are interleaved, read the rows in group order
+            blocks = _group_ordered_blocks(x, codes, block_rows)
+        else:
+            blocks = _slice_blocks(x, block_rows)
+    sumsq = None
+    buffer = None
+    for block_idx, block in blocks:
+        if sumsq is None:
+            sumsq = np.zeros((n_groups, block.shape[1]), dtype = np.float64)
+        sq, buffer = _squared(block, buffer)
+        # Squared weights of the block spread over the groups it holds
+        block_groups, local = np.unique(codes[block_idx], return_inverse = True)
+        block_weights = np.zeros((len(block_idx), len(block_groups)), dtype = np.float64)
+        block_weights[np.arange(len(block_idx)), local] = weights_sq[block_idx]
+        sumsq[block_groups] += np.dot(block_weights.T, sq)
+    if sumsq is None:
+        # No observations
+        sumsq = np.zeros((n_groups, npar or 0), dtype = np.float64)
+    return sumsq
+
+def _row_blocks(jco, nobs, block_rows = None):
+    ''' (row positions, block) over jco: consecutive blocks of block_rows
+    rows of a DataFrame, array, memmap or sparse matrix, or an iterable of
+    row blocks read once as they come '''
+    x = dense_values(jco)
+    if is_row_blocks(x):
+        return _stream_blocks(x, nobs)
+    if is_sparse(x):
+        # Rows of CSR are cheap to slice
+        x = x.tocsr()
+    if block_rows is None:
+        block_rows = _default_block_rows(x.shape[1])
+    return _slice_blocks(x, block_rows)
+
+def dense_row_sumsq(jco, nobs, block_rows = None):
+    ''' Sum over parameters of Jacobian**2 for each of the nobs observations
+
+    jco may be a DataFrame, array or memmap, read block_rows rows at a time,
+    or an iterable of row blocks (dense or sparse, in observation order)
+    read once as they come.  Sums are accumulated in float64 whatever the
+    dtype of jco
+    '''
+    sumsq = np.zeros(nobs, dtype = np.float64)
+    buffer = None
+    for block_idx, block in _row_blocks(jco, nobs, block_rows):
+        sq, buffer = _squared(block, buffer)
+        sumsq[block_idx] = sq.sum(axis = 1)
+    return sumsq
+
+def _weighted(block, weights, buffer):
+    ''' Rows of a dense or sparse block scaled by weights, Q^(1/2) J, in
+    float64 in buffer if it fits.  Returns the block and the (possibly new)
+    buffer '''
+    if buffer is None or buffer.shape[0] < block.shape[0] or buffer.shape[1] != block.shape[1]:
+        buffer = np.empty(block.shape, dtype = np.float64)
+    scaled = buffer[:block.shape[0]]
+    if is_sparse(block):
+        scaled[...] = block.toarray()
+    else:
+        scaled[...] = block
+    scaled *= weights[:, np.newaxis]
+    return scaled, buffer
+
+def normal_matrix(jco, weights, block_rows = None):
+    ''' Normal matrix J^T Q J, Q = diag(weights**2)
+
+    jco may be a DataFrame, array, memmap or sparse matrix, read block_rows
+    rows at a time, or an iterable of row blocks (dense or sparse, in
+    observation order) read once as they come.  Each block of Q^(1/2) J is
+    added with BLAS syrk, in place when scipy is available, so memory is
+    the npar x npar result plus one block, rather than the nobs x nobs Q or
+    a copy of the Jacobian.  Accumulated in float64 whatever the dtype of
+    jco
+    '''
+    try:
+        from scipy.linalg.blas import dsyrk
+    except ImportError:
+        dsyrk = None
+    weights = np.asarray(weights, dtype = np.float64)
+    xtqx = None
+    buffer = None
+    for block_idx, block in _row_blocks(jco, len(weights), block_rows):
+        if xtqx is None:
+            # Fortran order so dsyrk can update it in place
+            xtqx = np.zeros((block.shape[1], block.shape[1]), dtype = np.float64, order = 'F')
+        scaled, buffer = _weighted(block, weights[block_idx], buffer)
+        if dsyrk is not None:
+            # Upper triangle only, filled in below
+            xtqx = dsyrk(1.0, scaled.T, beta = 1.0, c = xtqx, overwrite_c = 1)
+        else:
+            xtqx += np.dot(scaled.T, scaled)
+    if xtqx is None:
+        raise ValueError('Jacobian has no observations')
+    if dsyrk is not None:
+        _fill_lower(xtqx)
+    return xtqx
+
+def _fill_lower(a, block_cols = 256):
+    ''' Copy the upper triangle of the square array a into its lower
+    triangle in place, a block of columns at a time so temporaries are
+    npar x block_cols rather than the size of a '''
+    n = a.shape[0]
+    for start in range(0, n, block_cols):
+        end = min(start + block_cols, n)
+        diagonal = a[start:end, start:end]
+        diagonal[...] = np.triu(diagonal) + np.triu(diagonal, 1).T
+        a[end:, start:end] = a[start:end, end:].T
+
+def weighted_r(jco, weights, block_rows = None):
+    ''' Upper triangular R of the QR decomposition of Q^(1/2) J, which has
+    the same singular values and right singular vectors
+
+    jco is read in blocks as in normal_matrix.  R is updated with the QR
+    of R stacked on each block, so memory is R plus one block and the
+    normal matrix is never formed
+    '''
+    weights = np.asarray(weights, dtype = np.float64)
+    if block_rows is None and not is_row_blocks(dense_values(jco)):
+        # Blocks of at least npar rows keep the repeated QR of R cheap
+        npar = jco.shape[1]
+        block_rows = max(npar, _default_block_rows(npar))
+    r = None
+    buffer = None
+    for block_idx, block in _row_blocks(jco, len(weights), block_rows):
+        scaled, buffer = _weighted(block, weights[block_idx], buffer)
+        if r is not None:
+            scaled = np.vstack((r, scaled))
+        r = np.linalg.qr(scaled, mode = 'r')
+    if r is None:
+        raise ValueError('Jacobian has no observations')
+    return r
+
+def normal_product(jco, weights, x, block_rows = None):
+    ''' J^T Q J x for an npar x m array x, as J^T (Q (J x)) so the normal
+    matrix is never formed
+
+    jco may be a DataFrame, array, memmap or sparse matrix, read
+    block_rows rows at a time, so memory is one block and its block x m
+    product
+    '''
+    j = dense_values(jco)
+    if is_row_blocks(j):
+        raise ValueError('J^T Q J x needs a Jacobian that can be read more '
+                         'than once, not an iterable of row blocks')
+    weights_sq = np.asarray(weights, dtype = np.float64)**2
+    if block_rows is None:
+        # Larger blocks than for the sums of squares, as each block is
+        # used in two gemm
+        block_rows = max(x.shape[1], 16 * _default_block_rows(j.shape[1]))
+    result = np.zeros((j.shape[1], x.shape[1]), dtype = np.float64)
+    for block_idx, block in _row_blocks(j, len(weights_sq), block_rows):
+        y = np.asarray(block.dot(x), dtype = np.float64)
+        y *= weights_sq[block_idx, np.newaxis]
+        result += np.asarray(block.T.dot(y))
+    return result
+
+def obs_arrays(obs, obs_names):
+    ''' Weights, group codes and group names of observations in Jacobian 
+    row order, from a pest_tools.Pst or a dictionary from load_obs '''
+    if hasattr(obs, 'obs_arrays'):
+        return obs.obs_arrays(obs_names)
+    weights = np.array([float(obs[ob][1]) for ob in obs_names], dtype = np.float64)
+    groups = pd.Categorical([obs[ob][2] for ob in obs_names])
+    return weights, groups.codes, pd.Index(groups.categories)
+
+def par_arrays(pars, par_names):
+    ''' Group codes and group names of parameters in Jacobian column order, 
+    from a pest_tools.Pst or a dictionary from load_pars '''
+    if hasattr(pars, 'par_arrays'):
+        return pars.par_arrays(par_names)
+    groups = pd.Categorical([pars[par][5] for par in par_names])
+    return groups.codes, pd.Index(groups.categories)
+
+def keep_groups_mask(groups, drop_regul = False, drop_groups = None, 
+                     keep_groups = None):
+    ''' Boolean array, True for each group in groups left in by the filters
+    of ParSen (case insensitive) '''
+    lower_groups = [group.lower() for group in groups]
+    keep = np.ones(len(lower_groups), dtype = bool)
+    if drop_regul == True:
+        keep &= np.array(['regul' not in group for group in lower_groups], dtype = bool)
+    if drop_groups != None:
+        drop_groups = [item.lower() for item in drop_groups]
+        keep &= np.array([group not in drop_groups for group in lower_groups], dtype = bool)
+    if keep_groups != None:
+        keep_groups = [item.lower() for item in keep_groups]
+        keep &= np.array([group in keep_groups for group in lower_groups], dtype = bool)
+    return keep
@@ -0,0 +1,73 @@
+''' Cached most/least sensitive queries shared by ParSen and ObSen
+'''
+import numpy as np
+
+def _unchanged(values, saved):
+    ''' True if values equal the saved copy, NaN matching NaN '''
+    if saved is None or values.shape != saved.shape:
+        return False
+    same = values == saved
+    if values.dtype.kind == 'f':
+        same |= np.isnan(values) & np.isnan(saved)
+    return bool(np.all(same))
+
+class Ranked(object):
+    ''' Base class for a df with a Sensitivity column and a group column
+
+    The descending order of the rows, overall and within each group, is
+    sorted once and cached, so repeated head, tail, group and plot calls
+    for any number of rows only slice it.  The cache is cleared when df is
+    assigned again or its Sensitivity (or, for group queries, group) 
+    values change, including edits in place.  Subclasses set 
+    _group_column.
+    '''
+    _group_column = None
+
+    def _get_df(self):
+        return self._df
+
+    def _set_df(self, df):
+        self._df = df
+        # Cached orders are only valid for this df
+        self._rank_cache = dict()
+        self._rank_values = None
+        self._rank_groups = None
+
+    df = property(_get_df, _set_df)
+
+    def _order(self, group = None):
+        ''' Positions in df of all rows, or of the rows of one group, most 
+        sensitive first as in df sorted on Sensitivity '''
+        values = self.df['Sensitivity'].values
+        # Compared with a copy, so edits in place are seen
+        if not _unchanged(values, self._rank_values):
+            self._rank_cache = dict()
+            self._rank_values = values.copy()
+            self._rank_groups = None
+        if group is not None:
+            groups = self.df[self._group_column].values
+            if not _unchanged(groups, self._rank_groups):
+                self._rank_cache = dict([(None, self._rank_cache[None])] 
+                                        if None in self._rank_cache else [])
+                self._rank_groups = groups.copy()
+        if group not in self._rank_cache:
+            if group is None:
+                candidates = np.arange(len(values))
+            else:
+                candidates = np.flatnonzero(groups == group)
+            # Stable, so ties keep the order of df
+            order = np.argsort(-values[candidates], kind = 'mergesort')
+            self._rank_cache[group] = candidates[order]
+        return self._rank_cache[group]
+
+    def _top(self, n = None, group = None):
+        ''' Positions in df of the n most sensitive rows (n > 0), the -n least
+        sensitive rows (n < 0) or all rows (n = None), optionally only of one
+        group.  Most sensitive first, as in df sorted on Sensitivity '''
+        order = self._order(group)
+        if n is None:
+            return order
+        k = min(abs(n), len(order))
+        if n > 0:
+            return order[:k]
+        return order[len(order) - k:]
@@ -1,11 +1,102 @@
 
+import warnings
+
 import numpy as np
 import pandas as pd
 import pest_tools as pt
 import matplotlib.pyplot as plt
 
-class Cor:
-    def __init__(self, jco_df, res_df):
+from _jco import jco_names, normal_matrix, normal_product, weighted_r
+
+_solvers = ('auto', 'eigh', 'svd', 'cholesky', 'inv', 'randomized')
+
+# Solvers giving the eigen-decomposition of J^T Q J, from which the
+# covariance and its eigen-decomposition both follow
+_spectral_solvers = ('eigh', 'svd', 'randomized')
+
+# Smallest number of extra columns in the random test matrix, which has at
+# least twice the columns of the eigenpairs wanted, and subspace iterations
+# used by the randomized solver
+_oversample = 20
+_power_iterations = 4
+
+def _cond_rank(values, rcond):
+    ''' Condition number and rank of a symmetric matrix from its eigenvalues
+    in ascending order, counting eigenvalues above rcond * largest '''
+    if values[0] > 0:
+        cond = values[-1] / values[0]
+    else:
+        cond = np.inf
+    return cond, int(np.count_nonzero(values > rcond * values[-1]))
+
+def _cov_values(values, scale, rcond):
+    ''' Eigenvalues of the covariance from the eigenvalues of the normal
+    matrix.  If rcond is given, those at or below rcond * largest are
+    truncated to zero as in a pseudo-inverse, otherwise all are inverted
+    as by an explicit inverse '''
+    if rcond is None:
+        if (values == 0).any():
+            raise np.linalg.LinAlgError('J^T Q J is singular, pass rcond to '
+                                        'truncate its zero eigenvalues')
+        return scale / values
+    keep = values > rcond * values[-1]
+    cov_values = np.zeros(len(values))
+    cov_values[keep] = scale / values[keep]
+    return cov_values
+
+def _spectral_cov(values, vectors, scale, rcond):
+    ''' Covariance from the eigen-decomposition of the normal matrix
+    (eigenvalues ascending) '''
+    cov_values = _cov_values(values, scale, rcond)
+    w = vectors * np.sqrt(np.abs(cov_values))
+    signs = np.sign(cov_values[cov_values != 0])
+    if len(signs) == 0 or (signs == signs[0]).all():
+        # V diag(cov_values) V^T as W W^T, which numpy passes to BLAS syrk
+        return (signs[0] if len(signs) > 0 else 1.0) * np.dot(w, w.T)
+    # Eigenvalues of both signs, from an indefinite J^T Q J
+    return np.dot(w * np.sign(cov_values), w.T)
+
+def _spectral_cov_eig(values, vectors, scale, rcond):
+    ''' Eigenvalues (ascending) and eigenvectors of the covariance from the
+    eigen-decomposition of the normal matrix, without forming either '''
+    cov_values = _cov_values(values, scale, rcond)
+    # Eigenvalues of the covariance are the reciprocals, so reverse to
+    # keep them ascending as from np.linalg.eigh
+    order = np.argsort(cov_values, kind = 'mergesort')
+    return cov_values[order], vectors[:, order]
+
+def _warn_ill_conditioned(values, rcond):
+    ''' Warn if eigenvalues of the normal matrix (ascending) at or below
+    rcond * largest are inverted without truncation '''
+    n_small = np.count_nonzero(values <= rcond * values[-1])
+    if n_small > 0:
+        warnings.warn('%d of %d eigenvalues of J^T Q J are at or below %g * '
+                      'largest and were inverted without truncation, so the '
+                      'covariance of those parameter combinations is '
+                      'unreliable.  Pass rcond to truncate them'
+                      % (n_small, len(values), rcond), RuntimeWarning)
+
+def _randomized_eigh(product, npar, k):
+    ''' Leading k eigenpairs (eigenvalues ascending) of a symmetric positive
+    semi-definite npar x npar matrix known only through product(x), the
+    matrix times an npar x m array
+
+    Randomized range finder with subspace iterations followed by a
+    Rayleigh-Ritz step (Halko, Martinsson and Tropp, 2011).  Needs
+    _power_iterations + 2 products with arrays of about npar x 2k
+    '''
+    n_cols = min(npar, max(2 * k, k + _oversample))
+    # Fixed seed so repeated runs give the same result
+    y = product(np.random.RandomState(0).standard_normal((npar, n_cols)))
+    for i in range(_power_iterations):
+        y = product(np.linalg.qr(y)[0])
+    basis = np.linalg.qr(y)[0]
+    values, vectors = np.linalg.eigh(np.dot(basis.T, product(basis)))
+    return values[-k:], np.dot(basis, vectors[:, -k:])
+
+class Cor(object):
+    def __init__(self, jco_df, res_df, pst = None, solver = 'auto', rcond = None,
+                 n_eig = None, par_names = None, obs_names = None, chunk_size = None):
         ''' Read pandas data frame of Jacobian and return observation 
         sensitivities
         
@@ -13,53 +104,298 @@ class Cor:
         ----------
         jco_df : Pandas dataframe
             Pandas data frame of the Jacobian returned from pest_tools.load_jco
+            A memmap or sparse matrix from pest_tools.load_jco(..., memmap = True)
+            or (..., sparse = True), or an iterable of blocks of rows (arrays,
+            DataFrames or sparse matrices, in observation order) may be used,
+            in which case par_names and obs_names are required.  J^T Q J is
+            accumulated block by block, so only it and one block are held in
+            memory.  Blocks from an iterable are read once, which the
+            'randomized' solver can not use
     
         res_df: Pandas dataframe
             Pandas data frame of residual information from pest_tools.res
-        
+
+        pst: pest_tools.Pst, optional
+            Parsed control file.  If given, weights are taken from the Pst
+            aligned with the rows of jco_df by name (lookup memoized on the Pst)
+            instead of from res_df['Weight']
+
+        solver: {'auto', 'eigh', 'svd', 'cholesky', 'inv', 'randomized'}, optional
+            How the normal matrix J^T Q J is inverted.  Default is 'auto'
+
+            'auto': as 'cholesky' for the covariance and correlation, with
+            one eigen-decomposition of the covariance only if eig_values,
+            eig_vectors, condition_number or rank are used.  If those are
+            used first, J^T Q J is not positive definite or scipy is not
+            installed, as 'eigh'.  With rcond, as 'eigh'
+
+            'eigh': one eigen-decomposition of J^T Q J gives the covariance,
+            its eigenvalues and eigenvectors.  With rcond, eigenvalues at
+            or below rcond * largest are truncated, as in a pseudo-inverse,
+            so a singular or near-singular normal matrix still gives a
+            result
+
+            'svd': as 'eigh', from the singular value decomposition of
+            Q^(1/2) J.  Slower, but the normal matrix is never formed, so
+            its condition number is not squared
+
+            'cholesky': Cholesky factorization of J^T Q J, the fastest when
+            only the covariance or correlation is needed.  Raises
+            numpy.linalg.LinAlgError if J^T Q J is not positive definite.
+            The eigen-decomposition is a second factorization, run only
+            if eig_values or eig_vectors are used
+
+            'inv': explicit inverse followed by an eigen-decomposition of
+            the covariance, as in pest_tools <= 0.1.4
+
+            'randomized': only the n_eig largest eigenpairs of J^T Q J, by
+            a randomized range finder working from products with J and
+            J^T, so J^T Q J is never formed or factorized.  For 10k+
+            parameters.  The covariance is the low-rank approximation from
+            those eigenpairs, the covariance of the n_eig best determined
+            combinations of parameters (as in truncated SVD), and
+            eig_values and eig_vectors hold n_eig values and columns
+
+        rcond: float, optional
+            Relative cutoff for small eigenvalues of J^T Q J.  If given,
+            'eigh', 'svd' and 'randomized' truncate eigenvalues at or below
+            rcond * largest, dropping the variance of the poorly determined
+            parameter combinations.  Default is no truncation, all
+            eigenvalues are inverted as by 'inv', with a RuntimeWarning if
+            any are at or below npar * machine precision * largest.  The
+            same cutoff (npar * machine precision if not given) counts the
+            rank
+
+        n_eig: int, optional
+            Number of eigenpairs computed by the 'randomized' solver, where
+            it is required.  Ignored by the other solvers
+
+        par_names: list, optional
+            List of parameter names returned from pest_tools.load_jco.
+            Required if jco_df is not a DataFrame
+
+        obs_names: list, optional
+            List of observation names returned from pest_tools.load_jco.
+            Required if jco_df is not a DataFrame
+
+        chunk_size: int, optional
+            Number of rows of a dense, memmapped or sparse jco_df read at a
+            time.  Default is about 256k entries per block (at least npar
+            rows for 'svd', larger for 'randomized').  Blocks from an
+            iterable are used as given
+
         Attributes
-        -------     
+        -------
         df: correlation matrix in Pandas data frame
         array: correlation matrix in numpy array from
         eig_vectors: eigen vectors in pandas data frame
         eig_values: eigen values
         cov_df: covarience matrix in Pandas data frame
+        condition_number: condition number of J^T Q J.  A 1-norm estimate
+            for 'cholesky', and the ratio of the largest to the n_eig-th
+            eigenvalue for 'randomized'
+        rank: numerical rank of J^T Q J, eigenvalues above rcond * largest.
+            At most n_eig for 'randomized'
+
+        Notes
+        ------
+        Attributes are computed the first time they are used and cached,
+        so a Cor used only for a correlation plot never runs an
+        eigen-decomposition with the default 'auto' solver or with
+        'cholesky' or 'inv', and the 'eigh', 'svd' and 'randomized' solvers
+        give eig_values and eig_vectors without forming the covariance.  All
+        attributes share one factorization of J^T Q J (with 'auto',
+        'cholesky' and 'inv' the eigen-decomposition of the covariance is a
+        second, run only if used after the covariance), and the Jacobian is
+        read only once (several times for 'randomized'), when the first is
+        used.
         
         
         '''
-        pars = jco_df.columns.values
+        par_names, obs_names = jco_names(jco_df, par_names, obs_names)
+        pars = np.array(par_names, dtype = object)
         phi = sum(res_df['Weighted Residual']**2)
-        weights = res_df['Weight'].values
-        q = np.diag(np.diag(np.tile(weights**2, (len(weights), 1))))
-        
-        # Calc Covarience Matrix
+        if pst is not None:
+            weights = pst.obs_arrays(obs_names)[0]
+        else:
+            weights = res_df['Weight'].values
+        if solver not in _solvers:
+            raise ValueError('solver must be one of %s, not %r' % (', '.join(_solvers), solver))
+        if solver == 'auto' and rcond is not None:
+            # Truncation needs the eigen-decomposition of J^T Q J
+            solver = 'eigh'
+        if solver == 'randomized' and (n_eig is None or not 0 < n_eig <= len(pars)):
+            raise ValueError('solver randomized needs n_eig between 1 and %d, not %r'
+                             % (len(pars), n_eig))
+
         # See eq. 2.17 in PEST Manual
         # Note: Number of observations are number of non-zero weighted observations
-        cov = np.dot((phi/(np.count_nonzero(weights)-len(pars))),
-                     (np.linalg.inv(np.dot(np.dot(jco_df.values.T, q),jco_df.values))))
-        
-        # Put into dataframe
-        cov_df = pd.DataFrame(cov, index = pars, columns = pars)
-        
-        # Calc correlation matrix   
-        d = np.diag(cov)
-        cor = cov/np.sqrt(np.multiply.outer(d,d))
-        # Put into dataframe
-        cor_df = pd.DataFrame(cor, index = pars, columns = pars)
-        
-        # Calc eigenvalues, eigenvectors
-        eig_values, eig_vectors = np.linalg.eigh(cov)
-        #Put eig_vectors into dataframe
-        eig_vectors_df = pd.DataFrame(eig_vectors, index = pars)
-        
-        
-        self.df = cor_df
-        self.array = cor
-        self.eig_vectors = eig_vectors_df
-        self.eig_values = eig_values
-        self.cov_df = cov_df
-        
-        
+        self._scale = phi/(np.count_nonzero(weights)-len(pars))
+
+        self._jco = jco_df
+        self._weights = weights
+        self._pars = pars
+        self._solver = solver
+        # Truncation cutoff, None for none, and cutoff counting the rank
+        self._rcond = rcond
+        if rcond is None:
+            rcond = len(pars) * np.finfo(np.float64).eps
+        self._rank_rcond = rcond
+        self._n_eig = n_eig
+        self._chunk_size = chunk_size
+        # Products computed so far, see _cached
+        self._cache = dict()
+
+    def _cached(self, key, compute):
+        ''' Value of compute() stored under key the first time it is asked
+        for '''
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def _release_jco(self):
+        ''' Drop the Jacobian once its factorization is cached '''
+        self._jco = None
+        self._weights = None
+
+    def _spectrum(self, xtqx = None):
+        ''' Eigenvalues (ascending) and eigenvectors of J^T Q J, for the
+        'eigh', 'svd' and 'randomized' solvers and 'auto' when needed.
+        xtqx is J^T Q J if already formed '''
+        def compute():
+            if self._solver == 'svd':
+                # Only V and the singular values of Q^(1/2) J are needed,
+                # from the small triangular factor of its QR decomposition
+                r = weighted_r(self._jco, self._weights, self._chunk_size)
+                sing_values, vt = np.linalg.svd(r)[1:]
+                # With fewer observations than parameters R has nobs rows,
+                # the remaining rows of V^T span the null space of J, 
+                # eigenvalues zero
+                values = np.zeros(vt.shape[0])
+                values[:len(sing_values)] = sing_values**2
+                values, vectors = values[::-1], vt[::-1].T
+            elif self._solver == 'randomized':
+                # Products J^T Q J x, without forming J^T Q J
+                product = lambda x: normal_product(self._jco, self._weights, x,
+                                                   self._chunk_size)
+                values, vectors = _randomized_eigh(product, len(self._pars), self._n_eig)
+            elif xtqx is not None:
+                values, vectors = np.linalg.eigh(xtqx)
+            else:
+                # Normal matrix J^T Q J, without forming the nobs x nobs Q
+                values, vectors = np.linalg.eigh(normal_matrix(self._jco, self._weights,
+                                                               self._chunk_size))
+            self._release_jco()
+            if self._rcond is None:
+                _warn_ill_conditioned(values, self._rank_rcond)
+            return values, vectors
+        return self._cached('spectrum', compute)
+
+    def _cov(self):
+        ''' Covariance matrix as an array '''
+        def compute():
+            if self._solver in _spectral_solvers or 'spectrum' in self._cache:
+                values, vectors = self._spectrum()
+                return _spectral_cov(values, vectors, self._scale, self._rcond)
+            xtqx = normal_matrix(self._jco, self._weights, self._chunk_size)
+            # The Jacobian is kept until the factorization succeeds, so a
+            # LinAlgError leaves the Cor usable
+            if self._solver in ('cholesky', 'auto'):
+                try:
+                    from scipy.linalg import cho_factor, cho_solve
+                    from scipy.linalg.lapack import dpocon
+                    factor = cho_factor(xtqx, lower = True)
+                except (ImportError, np.linalg.LinAlgError):
+                    if self._solver == 'cholesky':
+                        raise
+                    # No scipy, or not positive definite, from the 
+                    # eigen-decomposition
+                    values, vectors = self._spectrum(xtqx)
+                    return _spectral_cov(values, vectors, self._scale, self._rcond)
+                self._release_jco()
+                # LAPACK estimate of the reciprocal 1-norm condition number
+                rcond_estimate = dpocon(factor[0], np.abs(xtqx).sum(axis = 0).max(), uplo = 'L')[0]
+                self._cache['cholesky_cond'] = 1.0 / rcond_estimate if rcond_estimate > 0 else np.inf
+                if rcond_estimate <= self._rank_rcond:
+                    warnings.warn('J^T Q J has an estimated condition number of '
+                                  '%g, so the covariance of poorly determined '
+                                  'parameter combinations is unreliable.  Pass '
+                                  'rcond to truncate them'
+                                  % (self._cache['cholesky_cond']), RuntimeWarning)
+                return self._scale * cho_solve(factor, np.eye(len(self._pars)))
+            inverse = np.linalg.inv(xtqx)
+            self._release_jco()
+            return self._scale * inverse
+        return self._cached('cov', compute)
+
+    def _eig(self):
+        ''' Eigenvalues (ascending) and eigenvectors of the covariance '''
+        def compute():
+            if (self._solver in _spectral_solvers or 'spectrum' in self._cache
+                or (self._solver == 'auto' and 'cov' not in self._cache)):
+                # With 'auto' one eigen-decomposition of J^T Q J, rather than
+                # a Cholesky factorization followed by one of the covariance
+                values, vectors = self._spectrum()
+                return _spectral_cov_eig(values, vectors, self._scale, self._rcond)
+            return np.linalg.eigh(self._cov())
+        return self._cached('eig', compute)
+
+    def _condition(self):
+        ''' Condition number and rank of J^T Q J '''
+        def compute():
+            if self._solver == 'auto':
+                # From the covariance if it is already factorized, otherwise
+                # the eigen-decomposition of J^T Q J
+                self._eig()
+            if self._solver in _spectral_solvers or 'spectrum' in self._cache:
+                return _cond_rank(self._spectrum()[0], self._rank_rcond)
+            # Eigenvalues of J^T Q J are scale / eigenvalues of the covariance
+            cond, rank = _cond_rank(np.sort(self._scale / self._eig()[0]), self._rank_rcond)
+            if self._solver == 'cholesky':
+                cond = self._cache['cholesky_cond']
+            return cond, rank
+        return self._cached('condition', compute)
+
+    def _cor(self):
+        ''' Correlation matrix as an array '''
+        def compute():
+            cov = self._cov()
+            sd = np.sqrt(np.diag(cov))
+            cor = cov / sd[:, np.newaxis]
+            cor /= sd[np.newaxis, :]
+            return cor
+        return self._cached('cor', compute)
+
+    @property
+    def cov_df(self):
+        return self._cached('cov_df', lambda: pd.DataFrame(self._cov(), index = self._pars,
+                                                           columns = self._pars))
+
+    @property
+    def array(self):
+        return self._cor()
+
+    @property
+    def df(self):
+        return self._cached('df', lambda: pd.DataFrame(self._cor(), index = self._pars,
+                                                       columns = self._pars))
+
+    @property
+    def eig_values(self):
+        return self._eig()[0]
+
+    @property
+    def eig_vectors(self):
+        return self._cached('eig_vectors', lambda: pd.DataFrame(self._eig()[1], index = self._pars))
+
+    @property
+    def condition_number(self):
+        return self._condition()[0]
+
+    @property
+    def rank(self):
+        return self._condition()[1]
+
     def plot_img(self):
         """Plot correlation matrix
         Returns:
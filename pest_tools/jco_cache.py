@@ -0,0 +1,180 @@
+import glob
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+
+from load_jco import load_jco, _jco_return
+
+class JcoCache:
+    def __init__(self, cache_dir = None, max_bytes = 4 * 1024**3, use_hash = False):
+        ''' Create JcoCache class, a persistent binary cache of parsed .jco files
+
+        Parameters
+        ----------
+        cache_dir : {None, str}, optional
+            Directory to store cached Jacobians in.  If None (default) a
+            .jco_cache directory next to each .jco is used
+
+        max_bytes : int, optional
+            Maximum total size of the cache directory in bytes.  When storing
+            a new entry pushes the total over max_bytes the least recently
+            used entries are removed.  Default is 4 GB
+
+        use_hash : {False, True}, optional
+            If True an MD5 hash of the .jco contents is added to the cache
+            key.  Safer when files may be replaced without changing size or
+            modification time, but each load then reads the whole .jco
+
+        Notes
+        ------
+        Entries are keyed on the absolute path, size and modification time of
+        the .jco (plus the content hash if use_hash = True), so a changed
+        .jco is parsed again and its old entry is removed.  Entries are
+        uncompressed .npz files holding the matrix and the name arrays.
+
+        '''
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.use_hash = use_hash
+
+    def _dir(self, file_name):
+        ''' Cache directory used for file_name '''
+        if self.cache_dir is not None:
+            return self.cache_dir
+        return os.path.join(os.path.dirname(os.path.abspath(file_name)), '.jco_cache')
+
+    def _key(self, file_name, sparse, dtype = np.float64):
+        ''' Return (path key, stamp key) for file_name '''
+        path = os.path.abspath(file_name)
+        stat = os.stat(path)
+        stamp = '%d|%r' % (stat.st_size, stat.st_mtime)
+        if self.use_hash == True:
+            md5 = hashlib.md5()
+            f = open(path, 'rb')
+            while True:
+                block = f.read(2**20)
+                if block == '':
+                    break
+                md5.update(block)
+            f.close()
+            stamp = stamp + '|' + md5.hexdigest()
+        path_key = hashlib.sha1(path).hexdigest()[:16]
+        if sparse == True:
+            path_key = path_key + '_sparse'
+        else:
+            path_key = path_key + '_dense'
+        if np.dtype(dtype) != np.float64:
+            path_key = path_key + '_' + np.dtype(dtype).name
+        return path_key, hashlib.sha1(stamp).hexdigest()[:16]
+
+    def entry(self, file_name, sparse = False, dtype = np.float64):
+        ''' Return path of the cache entry for file_name '''
+        path_key, stamp_key = self._key(file_name, sparse, dtype)
+        return os.path.join(self._dir(file_name), '%s_%s.npz' % (path_key, stamp_key))
+
+    def load(self, file_name, return_par = True, return_obs = True, sparse = False,
+             dtype = np.float64):
+        ''' Load a Jacobian through the cache
+
+        Parameters
+        ----------
+        file_name : string
+            File name for .jco (binary) produced by PEST
+
+        return_par, return_obs, sparse, dtype
+            As for pest_tools.load_jco
+
+        Returns
+        -------
+        Same as pest_tools.load_jco
+
+        '''
+        entry = self.entry(file_name, sparse, dtype)
+        if os.path.exists(entry):
+            jco_df, par_names, obs_names = self._read(entry, sparse)
+            # Mark as recently used for eviction
+            os.utime(entry, None)
+        else:
+            jco_df, par_names, obs_names = load_jco(file_name, sparse = sparse,
+                                                    dtype = dtype)
+            self._write(entry, jco_df, par_names, obs_names, sparse)
+            self._evict(os.path.dirname(entry), entry)
+        return _jco_return(jco_df, par_names, obs_names, return_par, return_obs)
+
+    def _read(self, entry, sparse):
+        ''' Read a cache entry '''
+        data = np.load(entry)
+        try:
+            par_names = data['par_names'].tolist()
+            obs_names = data['obs_names'].tolist()
+            if sparse == True:
+                import scipy.sparse
+                jco_df = scipy.sparse.csc_matrix(
+                    (data['data'], data['indices'], data['indptr']),
+                    shape = (len(obs_names), len(par_names)))
+            else:
+                jco_df = pd.DataFrame(data['values'], index = obs_names,
+                                      columns = par_names, copy = False)
+        finally:
+            data.close()
+        return jco_df, par_names, obs_names
+
+    def _write(self, entry, jco_df, par_names, obs_names, sparse):
+        ''' Write a cache entry, replacing older entries for the same .jco '''
+        cache_dir = os.path.dirname(entry)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        path_key = os.path.basename(entry).rsplit('_', 1)[0]
+        for old_entry in glob.glob(os.path.join(cache_dir, path_key + '_*.npz')):
+            if os.path.basename(old_entry).rsplit('_', 1)[0] == path_key:
+                os.remove(old_entry)
+        arrays = {'par_names' : np.array(par_names),
+                  'obs_names' : np.array(obs_names)}
+        if sparse == True:
+            arrays['data'] = jco_df.data
+            arrays['indices'] = jco_df.indices
+            arrays['indptr'] = jco_df.indptr
+        else:
+            arrays['values'] = jco_df.values
+        # Write to a temporary file so a partial entry is never read
+        tmp_file = entry + '.tmp'
+        f = open(tmp_file, 'wb')
+        try:
+            np.savez(f, **arrays)
+        finally:
+            f.close()
+        os.rename(tmp_file, entry)
+
+    def _evict(self, cache_dir, keep):
+        ''' Remove least recently used entries until under max_bytes '''
+        entries = [(os.path.getmtime(e), os.path.getsize(e), e)
+                   for e in glob.glob(os.path.join(cache_dir, '*.npz'))]
+        total = sum([size for mtime, size, e in entries])
+        for mtime, size, e in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if e != keep:
+                os.remove(e)
+                total -= size
+
+    def clear(self, file_name = None):
+        ''' Remove cache entries
+
+        Parameters
+        ----------
+        file_name : {None, str}, optional
+            If given remove only the entries for this .jco, else remove all
+            entries in cache_dir (requires cache_dir)
+
+        '''
+        if file_name is not None:
+            cache_dir = self._dir(file_name)
+            path_key = hashlib.sha1(os.path.abspath(file_name)).hexdigest()[:16]
+            pattern = os.path.join(cache_dir, path_key + '_*.npz')
+        else:
+            if self.cache_dir is None:
+                raise ValueError('file_name is required when cache_dir is None')
+            pattern = os.path.join(self.cache_dir, '*.npz')
+        for e in glob.glob(pattern):
+            os.remove(e)
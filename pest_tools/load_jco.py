@@ -1,8 +1,186 @@
+import os
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import pandas as pd
 import struct
 
-def load_jco(file_name, return_par = True, return_obs = True):
+from load_obs import load_obs
+from load_pars import load_pars
+
+# Each data record in a .jco is a packed 4 byte integer (1-based index into
+# the column-major Jacobian) followed by an 8 byte float
+_record_dtype = np.dtype([('index', '<i4'), ('value', '<f8')])
+
+# Number of records held in memory at once when building the dense cache
+_chunk_records = 1000000
+
+def _read_header(f):
+    ''' Read npar, nobs and count from the start of an open .jco file '''
+    npar = abs(struct.unpack('i', f.read(4))[0])
+    nobs = abs(struct.unpack('i', f.read(4))[0])
+    count = abs(struct.unpack('i', f.read(4))[0])
+    return npar, nobs, count
+
+def _read_names(f, width, n):
+    ''' Read n fixed width names from an open .jco file into a list '''
+    names = np.fromfile(f, dtype = 'S%d' % (width), count = n)
+    if len(names) != n:
+        raise IOError('.jco name table is truncated: expected %d names, found %d'
+                      % (n, len(names)))
+    return [name.strip().lower() for name in names]
+
+def _read_name_tables(f, npar, nobs, count):
+    ''' Seek past the data records and read the parameter and obs names '''
+    f.seek(12 + count * _record_dtype.itemsize)
+    par_names = _read_names(f, 12, npar)
+    obs_names = _read_names(f, 20, nobs)
+    return par_names, obs_names
+
+def _read_records(f, count, file_name, chunk_records = None):
+    ''' Generator of blocks of data records from an open .jco file
+
+    Blocks hold at most chunk_records records.  If chunk_records is None all
+    records are returned in a single block.
+    '''
+    if chunk_records is None:
+        chunk_records = max(count, 1)
+    remaining = count
+    while remaining > 0:
+        n = min(chunk_records, remaining)
+        records = np.fromfile(f, dtype = _record_dtype, count = n)
+        if len(records) != n:
+            raise IOError('%s is truncated: expected %d records, found %d'
+                          % (file_name, count, count - remaining + len(records)))
+        remaining -= n
+        yield records
+
+def _scatter_records(records, nobs, x):
+    ''' Place a block of data records into the dense array x '''
+    # Convert 1-based column-major index to 0-based row and column
+    j = records['index'] - 1
+    x[j % nobs, j // nobs] = records['value']
+
+def _write_dense(file_name, dense_file, dtype = np.float64):
+    ''' Convert a .jco file into a dense .npy file for use with np.memmap
+
+    Records are scattered into the memory-mapped output a block at a time so
+    the Jacobian never has to fit in memory.  The output is written to a
+    temporary file first so an interrupted conversion is never used.
+    '''
+    tmp_file = dense_file + '.tmp'
+    f = open(file_name, 'rb')
+    try:
+        npar, nobs, count = _read_header(f)
+        x = np.lib.format.open_memmap(tmp_file, mode = 'w+', dtype = dtype,
+                                      shape = (nobs, npar))
+        for records in _read_records(f, count, file_name, _chunk_records):
+            _scatter_records(records, nobs, x)
+        x.flush()
+        del(x)
+    finally:
+        f.close()
+    if os.path.exists(dense_file):
+        os.remove(dense_file)
+    os.rename(tmp_file, dense_file)
+
+def _open_dense(file_name, dense_file, npar, nobs, dtype = np.float64):
+    ''' Open the dense cache of a .jco as a read only memmap
+
+    The cache is (re)built if it is missing, older than the .jco or does not
+    match the shape in the .jco header or the requested dtype.
+    '''
+    if (not os.path.exists(dense_file) or
+            os.path.getmtime(dense_file) < os.path.getmtime(file_name)):
+        _write_dense(file_name, dense_file, dtype)
+    x = np.load(dense_file, mmap_mode = 'r')
+    if x.shape != (nobs, npar) or x.dtype != dtype:
+        del(x)
+        _write_dense(file_name, dense_file, dtype)
+        x = np.load(dense_file, mmap_mode = 'r')
+    return x
+
+def _records_to_sparse(records, nobs, npar, dtype = np.float64):
+    ''' Build a scipy.sparse CSC matrix from a block of data records '''
+    import scipy.sparse
+    j = records['index'] - 1
+    rows = j % nobs
+    cols = j // nobs
+    values = records['value'].astype(dtype)
+    if len(j) == 0 or np.all(j[1:] > j[:-1]):
+        # PEST writes records in column-major order, so the CSC arrays can
+        # be used directly without sorting or summing duplicates
+        indptr = np.zeros(npar + 1, dtype = rows.dtype)
+        np.cumsum(np.bincount(cols, minlength = npar), out = indptr[1:])
+        return scipy.sparse.csc_matrix((values, rows, indptr),
+                                       shape = (nobs, npar))
+    return scipy.sparse.csc_matrix((values, (rows, cols)), shape = (nobs, npar))
+
+def _select(selector, names, kind, pst_file):
+    ''' Return sorted positions in names matched by an obs or pars selector
+
+    Returns None if selector is None (everything selected)
+    '''
+    if selector is None:
+        return None
+    if callable(selector):
+        keep = [i for i, name in enumerate(names) if selector(name)]
+    elif isinstance(selector, basestring):
+        # Selector is a group name, look up group of each name in the .pst
+        if pst_file is None:
+            raise ValueError('pst_file is required to select %s by group' % (kind))
+        group = selector.lower()
+        if kind == 'obs':
+            groups = dict((ob, values[2]) for ob, values in load_obs(pst_file).items())
+        else:
+            groups = dict((par, values[5]) for par, values in load_pars(pst_file).items())
+        if group not in set(groups.values()):
+            raise ValueError('%s group %s not in %s' % (kind, group, pst_file))
+        keep = [i for i, name in enumerate(names) if groups.get(name) == group]
+        if len(keep) == 0:
+            raise ValueError('No %s of group %s in Jacobian' % (kind, group))
+    else:
+        positions = dict((name, i) for i, name in enumerate(names))
+        wanted = [name.lower() for name in selector]
+        missing = [name for name in wanted if name not in positions]
+        if len(missing) > 0:
+            raise ValueError('%d %s not in Jacobian, first is %s'
+                             % (len(missing), kind, missing[0]))
+        keep = sorted(set(positions[name] for name in wanted))
+    return np.asarray(keep, dtype = int)
+
+def _position_map(idx, n):
+    ''' Array of length n giving the new position of each item in idx, or -1 '''
+    position = np.empty(n, dtype = np.int64)
+    position.fill(-1)
+    position[idx] = np.arange(len(idx))
+    return position
+
+def _select_records(records, nobs, row_map, col_map, nobs_subset):
+    ''' Keep records in the selected rows and columns, re-indexed to the subset '''
+    j = records['index'] - 1
+    rows = row_map[j % nobs]
+    cols = col_map[j // nobs]
+    keep = (rows >= 0) & (cols >= 0)
+    selected = np.empty(np.count_nonzero(keep), dtype = _record_dtype)
+    selected['index'] = cols[keep] * nobs_subset + rows[keep] + 1
+    selected['value'] = records['value'][keep]
+    return selected
+
+def _jco_return(jco_df, par_names, obs_names, return_par, return_obs):
+    ''' Build the return value of load_jco for the return_par/obs flags '''
+    if return_par == True and return_obs == True:             
+        return jco_df, par_names, obs_names
+    if return_par == True and return_obs == False:
+        return jco_df, par_names
+    if return_par == False and return_obs == True:
+        return jco_df, obs_names
+    if return_par == False and return_obs == False:
+        return jco_df
+
+def load_jco(file_name, return_par = True, return_obs = True, memmap = False,
+             dense_file = None, sparse = False, obs = None, pars = None,
+             pst_file = None, cache = None, dtype = np.float64):
     '''Read PEST Jacobian matrix file (binary) into Pandas data frame
     
     Parameters
@@ -16,11 +194,58 @@ def load_jco(file_name, return_par = True, return_obs = True):
     return_obs : {True, False}, optional
        If True (default) return list of observations
     
+    memmap : {False, True}, optional
+        If True the .jco is converted once into a dense .npy file 
+        (dense_file) and the returned DataFrame is a read only view of that 
+        file opened with np.memmap, so no copy of the Jacobian is held in 
+        memory.  The dense file is rebuilt if it is older than the .jco
+    
+    dense_file : {None, string}, optional
+        File name for the dense cache used when memmap = True.  Default is 
+        file_name with .npy appended (.float32.npy etc. for other dtypes)
+    
+    sparse : {False, True}, optional
+        If True return the Jacobian as a scipy.sparse CSC matrix built 
+        directly from the data records, without building the dense array.
+        Requires scipy
+    
+    obs : {None, list, str, callable}, optional
+        Observations (rows) to load.  Either a list of observation names, 
+        the name of an observation group in pst_file, or a function that 
+        takes an observation name and returns True to keep it.  If None 
+        (default) all observations are loaded.  Selected observations are
+        returned in the order they appear in the .jco
+    
+    pars : {None, list, str, callable}, optional
+        Parameters (columns) to load.  Either a list of parameter names, 
+        the name of a parameter group in pst_file, or a function that takes
+        a parameter name and returns True to keep it.  If None (default) 
+        all parameters are loaded
+    
+    pst_file : {None, string}, optional
+        PEST control file used to look up groups when obs or pars is a 
+        group name
+    
+    cache : {None, True, pest_tools.JcoCache}, optional
+        If True, or a JcoCache, the parsed Jacobian and names are stored in
+        a binary cache keyed on the path, size and modification time of the
+        .jco and reused by later calls.  True uses a JcoCache with default
+        settings (cache directory next to file_name).  Can not be combined 
+        with memmap, obs or pars
+    
+    dtype : numpy dtype, optional
+        Data type of the returned Jacobian.  Default is np.float64.  
+        np.float32 halves memory and is plenty for sensitivity ranking and
+        plotting; ParSen, ObSen and Cor accumulate norms and normal matrices
+        in float64 regardless of dtype
+    
     Returns
     -------
     jco_df : Pandas DataFrame 
         DataFrame of the Jacobian Matrix.  Index entries of DataFrame are 
-        observations (rows).  Columns are parameters
+        observations (rows).  Columns are parameters.  If sparse = True a 
+        scipy.sparse.csc_matrix with rows and columns in the order of 
+        ob_names and par_names
         
     par_names : list
        List of parmeter names.  Returned if return_par = True
@@ -28,55 +253,329 @@ def load_jco(file_name, return_par = True, return_obs = True):
     ob_names : list
         List of observation names. Returned if return_obs = True
     
+    Notes
+    ------
+    All data records are read in a single block and scattered into the 
+    matrix with array indexing rather than unpacked one at a time.  When obs
+    or pars are given the name tables are read first and the records are 
+    read in blocks, keeping only those in the selected rows and columns, so
+    memory scales with the size of the subset rather than the whole file.
     
     '''
+    if memmap == True and sparse == True:
+        raise ValueError('memmap and sparse can not both be True')
+    if cache is not None and cache is not False:
+        if memmap == True or obs is not None or pars is not None:
+            raise ValueError('cache can not be combined with memmap, obs or pars')
+        from jco_cache import JcoCache
+        if cache is True:
+            cache = JcoCache()
+        return cache.load(file_name, return_par = return_par, 
+                          return_obs = return_obs, sparse = sparse, 
+                          dtype = dtype)
+    dtype = np.dtype(dtype)
     f = open(file_name,'rb')
-    #--the header data type
-    npar = abs(struct.unpack('i', f.read(4))[0])
-    nobs = abs(struct.unpack('i', f.read(4))[0])
-    count = abs(struct.unpack('i', f.read(4))[0])
-                                   
-    x = np.zeros((nobs, npar))    
-    
-    
-    #--read all data records
-    for record in range(count):
-        if count > 1000000:
-            if record % 1000000 == 0:
-                percent = (float(record) / count) *100
-                print '%.1f Percent; Record %s of %s \r' % (percent, record, count)
-        j = struct.unpack('i', f.read(4))[0]
-        col = ((j-1) / nobs) + 1
-        row = j - ((col - 1) * nobs)
-        data = struct.unpack('d', f.read(8))[0]
-        x[row-1, col-1] = data
-    
-    #--read parameter names
-    par_names = []
-    for i in range(npar):
-        par_name = struct.unpack('12s', f.read(12))[0].strip().lower() 
-        par_names.append(par_name)
-        #print 'par:',pn
-    
-    #--read obs names
-    obs_names = []
-    for i in range(nobs):
-        ob_name = struct.unpack('20s', f.read(20))[0].strip().lower()
-        obs_names.append(ob_name)
-        #print 'obs:',on
-    
-    f.close()
-    
-    
-    jco_df = pd.DataFrame(x, index = obs_names, columns = par_names)
+    try:
+        #--the header data type
+        npar, nobs, count = _read_header(f)
+        
+        #--read the name tables first, they follow the data records
+        par_names, obs_names = _read_name_tables(f, npar, nobs, count)
+        
+        #--positions of the requested observations and parameters
+        obs_idx = _select(obs, obs_names, 'obs', pst_file)
+        par_idx = _select(pars, par_names, 'pars', pst_file)
+        subset = obs_idx is not None or par_idx is not None
+        if obs_idx is None:
+            obs_idx = np.arange(nobs)
+        if par_idx is None:
+            par_idx = np.arange(npar)
+        
+        if memmap == True:
+            if dense_file is None:
+                if dtype == np.float64:
+                    dense_file = file_name + '.npy'
+                else:
+                    dense_file = file_name + '.' + dtype.name + '.npy'
+            x = _open_dense(file_name, dense_file, npar, nobs, dtype)
+            if subset:
+                x = np.array(x[np.ix_(obs_idx, par_idx)])
+        else:
+            #--read the data records, keeping only the requested subset
+            f.seek(12)
+            if subset:
+                row_map = _position_map(obs_idx, nobs)
+                col_map = _position_map(par_idx, npar)
+                blocks = (_select_records(records, nobs, row_map, col_map, 
+                                          len(obs_idx))
+                          for records in _read_records(f, count, file_name, 
+                                                       _chunk_records))
+            else:
+                blocks = _read_records(f, count, file_name)
+            if sparse == True:
+                blocks = list(blocks)
+                if len(blocks) == 0:
+                    records = np.zeros(0, dtype = _record_dtype)
+                elif len(blocks) == 1:
+                    records = blocks[0]
+                else:
+                    records = np.concatenate(blocks)
+                del(blocks)
+                x = _records_to_sparse(records, len(obs_idx), len(par_idx), 
+                                       dtype)
+                del(records)
+            else:
+                x = np.zeros((len(obs_idx), len(par_idx)), dtype = dtype)
+                for records in blocks:
+                    _scatter_records(records, len(obs_idx), x)
+                del(blocks)
+    finally:
+        f.close()
+    
+    if subset:
+        obs_names = [obs_names[i] for i in obs_idx]
+        par_names = [par_names[i] for i in par_idx]
+    
+    if sparse == True:
+        jco_df = x
+    else:
+        jco_df = pd.DataFrame(x, index = obs_names, columns = par_names, 
+                              copy = False)
     # Clean Up
     del(x)  
-    if return_par == True and return_obs == True:             
-        return jco_df, par_names, obs_names
-    if return_par == True and return_obs == False:
-        return jco_df, par_names
-    if return_par == False and return_obs == True:
-        return jco_df, obs_names
-    if return_par == False and return_obs == False:
-        return jco_df
+    return _jco_return(jco_df, par_names, obs_names, return_par, return_obs)
+
+def jco_info(file_name):
+    '''Read the header and name tables of a PEST Jacobian matrix file (binary)
+    without reading the data records
+    
+    Parameters
+    ----------
+    file_name : string
+        File name for .jco (binary) produced by PEST
+    
+    Returns
+    -------
+    info : dict
+        Dictionary with keys
+            npar : number of parameters (columns)
+            nobs : number of observations (rows)
+            nnz : number of data records (stored entries)
+            density : nnz / (npar * nobs)
+            dense_bytes : memory needed by load_jco for the dense array
+            par_names : list of parameter names
+            obs_names : list of observation names
+    
+    Notes
+    ------
+    Uses the same header logic as load_jco but seeks straight past the data
+    records to the name tables, so the cost does not depend on nnz.
+    
+    '''
+    f = open(file_name, 'rb')
+    try:
+        npar, nobs, count = _read_header(f)
+        par_names, obs_names = _read_name_tables(f, npar, nobs, count)
+    finally:
+        f.close()
+    if npar * nobs > 0:
+        density = count / float(npar * nobs)
+    else:
+        density = 0.0
+    info = {'npar' : npar, 'nobs' : nobs, 'nnz' : count, 'density' : density, 
+            'dense_bytes' : npar * nobs * np.dtype(np.float64).itemsize,
+            'par_names' : par_names, 'obs_names' : obs_names}
+    return info
+
+def _fill_dense(file_name, x):
+    ''' Read the data records of a .jco into the existing dense array x '''
+    f = open(file_name, 'rb')
+    try:
+        npar, nobs, count = _read_header(f)
+        if x.shape != (nobs, npar):
+            raise ValueError('%s has shape %s, expected %s' 
+                             % (file_name, (nobs, npar), x.shape))
+        for records in _read_records(f, count, file_name):
+            _scatter_records(records, nobs, x)
+    finally:
+        f.close()
+
+def load_jcos(file_names, workers = None, stack = False, dtype = np.float64):
+    '''Read several PEST Jacobian matrix files (binary) concurrently, e.g. 
+    the .jco saved at each PEST iteration
+    
+    Parameters
+    ----------
+    file_names : list
+        List of .jco file names
+    
+    workers : {None, int}, optional
+        Number of threads used to read files.  Default is the number of 
+        CPUs.  Reading and scattering the records is done in numpy, which
+        releases the GIL, so the files are decoded in parallel
+    
+    stack : {False, True}, optional
+        If True return the Jacobians stacked into a single 3-D array, which
+        requires all files to have identical name tables
+    
+    dtype : numpy dtype, optional
+        Data type of the returned Jacobians.  Default is np.float64
+    
+    Returns
+    -------
+    jcos : dict
+        If stack = False.  Dictionary of file name as key and Jacobian 
+        DataFrame as value.  DataFrames of files with identical name tables
+        share the same index and column objects
+    
+    jcos, par_names, ob_names : numpy array, list, list
+        If stack = True.  Array of shape (len(file_names), nobs, npar) with 
+        jcos[i] the Jacobian of file_names[i], and the shared names
+    
+    '''
+    file_names = list(file_names)
+    if workers is None:
+        workers = cpu_count()
+    workers = max(1, min(workers, len(file_names)))
+    pool = ThreadPool(workers)
+    try:
+        infos = pool.map(jco_info, file_names)
+        
+        # Share name tables between files where they are identical
+        tables = []
+        table_idx = []
+        for info in infos:
+            for i, (par_names, obs_names) in enumerate(tables):
+                if info['par_names'] == par_names and info['obs_names'] == obs_names:
+                    table_idx.append(i)
+                    break
+            else:
+                table_idx.append(len(tables))
+                tables.append((info['par_names'], info['obs_names']))
+        del(infos)
+        
+        if stack == True:
+            if len(tables) > 1:
+                raise ValueError('stack = True requires identical name tables, '
+                                 'found %d different tables' % (len(tables)))
+            par_names, obs_names = tables[0]
+            jcos = np.zeros((len(file_names), len(obs_names), len(par_names)),
+                            dtype = dtype)
+            pool.map(lambda i: _fill_dense(file_names[i], jcos[i]),
+                     range(len(file_names)))
+            return jcos, par_names, obs_names
+        
+        arrays = [np.zeros((len(tables[i][1]), len(tables[i][0])), dtype = dtype)
+                  for i in table_idx]
+        pool.map(lambda i: _fill_dense(file_names[i], arrays[i]),
+                 range(len(file_names)))
+    finally:
+        pool.close()
+        pool.join()
+    
+    indexes = [(pd.Index(pn), pd.Index(on)) for pn, on in tables]
+    jcos = dict()
+    for file_name, x, i in zip(file_names, arrays, table_idx):
+        jcos[file_name] = pd.DataFrame(x, index = indexes[i][1], 
+                                       columns = indexes[i][0], copy = False)
+    return jcos
+
+def iter_jco(file_name, chunk_records = 1000000, dense = False):
+    '''Stream the data records of a PEST Jacobian matrix file (binary) in 
+    blocks, without holding the full matrix in memory
+    
+    Parameters
+    ----------
+    file_name : string
+        File name for .jco (binary) produced by PEST
+    
+    chunk_records : int, optional
+        Number of records read from the file at a time.  Default is 1000000
+    
+    dense : {False, True}, optional
+        If False (default) yield blocks of records as arrays of 0-based row 
+        index, column index and value.  If True yield blocks of consecutive
+        whole columns as dense arrays
+    
+    Yields
+    ------
+    rows, cols, values : numpy arrays
+        If dense = False.  Row (observation) index, column (parameter) index
+        and value of each record in the block
+    
+    par_idx, block : numpy arrays
+        If dense = True.  Column indices of the block and the dense 
+        nobs x len(par_idx) array of those columns.  Each block holds at 
+        most about chunk_records values, and every column is yielded once, 
+        including columns with no records
+    
+    Notes
+    ------
+    Parameter and observation names, and the matrix shape, are available 
+    from pest_tools.jco_info.  dense = True requires the records to be in
+    the column-major order PEST writes them in; a ValueError is raised 
+    otherwise.
+    
+    Examples
+    --------
+    Column sums of squares in a single streaming pass:
+    
+    >>> info = pt.jco_info('example.jco')
+    >>> sumsq = np.zeros(info['npar'])
+    >>> for rows, cols, values in pt.iter_jco('example.jco'):
+    ...     sumsq += np.bincount(cols, values**2, minlength = info['npar'])
+    
+    '''
+    f = open(file_name, 'rb')
+    try:
+        npar, nobs, count = _read_header(f)
+        blocks = _read_records(f, count, file_name, chunk_records)
+        if dense == False:
+            for records in blocks:
+                j = records['index'] - 1
+                yield j % nobs, j // nobs, records['value']
+        else:
+            for par_idx, block in _iter_dense_columns(blocks, npar, nobs, 
+                                                      chunk_records):
+                yield par_idx, block
+    finally:
+        f.close()
 
+def _iter_dense_columns(blocks, npar, nobs, chunk_records):
+    ''' Generator of dense blocks of whole columns from column-ordered records '''
+    width = max(1, chunk_records // max(nobs, 1))
+    pending = np.zeros(0, dtype = _record_dtype)
+    next_col = 0
+    last_index = 0
+    finished = False
+    while not finished:
+        try:
+            records = next(blocks)
+        except StopIteration:
+            records = np.zeros(0, dtype = _record_dtype)
+            finished = True
+        if len(records) > 0:
+            if records['index'][0] <= last_index or np.any(
+                    records['index'][1:] <= records['index'][:-1]):
+                raise ValueError('.jco records are not in column-major order, '
+                                 'use dense = False')
+            last_index = records['index'][-1]
+        pending = np.concatenate([pending, records])
+        cols = (pending['index'] - 1) // nobs
+        if finished:
+            # Everything left, including trailing empty columns
+            end_col = npar
+        elif len(cols) > 0:
+            # The last column may continue in the next block of records
+            end_col = cols[-1]
+        else:
+            continue
+        for start in range(next_col, end_col, width):
+            stop = min(start + width, end_col)
+            lo, hi = np.searchsorted(cols, [start, stop])
+            block = np.zeros((nobs, stop - start))
+            j = pending['index'][lo:hi] - 1
+            block[j % nobs, j // nobs - start] = pending['value'][lo:hi]
+            yield np.arange(start, stop), block
+        next_col = max(next_col, end_col)
+        pending = pending[np.searchsorted(cols, next_col):]
@@ -4,19 +4,45 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
+from _rank import Ranked
+from _jco import is_sparse, jco_names, sparse_row_sumsq, dense_row_sumsq, \
+                 obs_arrays
 
 
-class ObSen:
-    def __init__(self, jco_df, obs_dict):
+class ObSen(Ranked):
+    _group_column = 'Ob Groups'
+    
+    def __init__(self, jco_df, obs_dict, par_names = None, obs_names = None, chunk_size = None):
         ''' Read data frame of Jacobian and return observation sensitivities
         
         Parameters
         ----------
-        jco_df : Pandas dataframe
-            Pandas data frame of the Jacobian returned from PestTools.load_jco
+        jco_df : Pandas dataframe, numpy array or scipy.sparse matrix
+            Pandas data frame of the Jacobian returned from PestTools.load_jco.
+            A memmap or sparse matrix from PestTools.load_jco(..., memmap = True)
+            or (..., sparse = True), or an iterable of blocks of rows (arrays,
+            DataFrames or sparse matrices, in observation order) may be used,
+            in which case par_names and obs_names are required.  Blocks are
+            read once, so a generator reading a Jacobian that does not fit
+            in memory can be used
     
-        obs_dict: dict
-            Dictionary of the observations returned from PestTools.load_obs
+        obs_dict: dict or Pst
+            Dictionary of the observations returned from PestTools.load_obs,
+            or a PestTools.Pst of the control file (weights and groups
+            aligned with the Jacobian are then built once and reused)
+            
+        par_names: list, optional
+            List of parameter names returned from PestTools.load_jco.
+            Required if jco_df is not a DataFrame
+            
+        obs_names: list, optional
+            List of observation names returned from PestTools.load_jco.
+            Required if jco_df is not a DataFrame
+
+        chunk_size: int, optional
+            Number of rows of a dense or memmapped jco_df read at a time,
+            which bounds the temporary memory used.  Default is about 256k
+            entries per block.  Blocks from an iterable are used as given
         
         Attributes
         -------
@@ -27,20 +53,22 @@ class ObSen:
         
         
         '''
-        # Get Ob Groups
-        ob_groups = []
-        for ob in jco_df.index:
-            ob_group = obs_dict[ob][2]
-            ob_groups.append(ob_group)  
-        
-        # Calculate Observation Sensitivities
-        ob_sensitivities = []
-        for ob in jco_df.index:
-            ob_sen = np.linalg.norm(np.asarray(jco_df.ix[ob]))*float(obs_dict[ob][1])/len(jco_df.columns)
-            ob_sensitivities.append(ob_sen)
+        par_names, obs_names = jco_names(jco_df, par_names, obs_names)
+        
+        # Get Ob Groups and weights, groups are mapped through their codes
+        weights, ob_codes, ob_group_names = obs_arrays(obs_dict, obs_names)
+        ob_groups = ob_group_names.values.take(ob_codes)
+        
+        # Calculate Observation Sensitivities, the norm of every row at once
+        if is_sparse(jco_df):
+            # Only touches the non-zero entries of the Jacobian
+            sumsq = sparse_row_sumsq(jco_df)
+        else:
+            sumsq = dense_row_sumsq(jco_df, len(obs_names), chunk_size)
+        ob_sensitivities = np.sqrt(sumsq)*weights/len(par_names)
             
         ob_sen_data = {'Sensitivity' : ob_sensitivities, 'Ob Groups' : ob_groups}
-        ob_sen_df = pd.DataFrame(ob_sen_data, index = jco_df.index)
+        ob_sen_df = pd.DataFrame(ob_sen_data, index = obs_names)
         
         self.df = ob_sen_df
         
@@ -57,7 +85,7 @@ class ObSen:
             Series of n_tail most sensitive observations
                 
         '''
-        return self.df.sort(columns = 'Sensitivity', ascending = False).tail(n=n_tail)['Sensitivity']
+        return self.df['Sensitivity'].iloc[self._top(-n_tail)]
         
     def head(self, n_head):
         ''' Get the most sensitive observations
@@ -71,7 +99,7 @@ class ObSen:
         pandas Series
             Series of n_tail most sensitive observations
         '''
-        return self.df.sort(columns = 'Sensitivity', ascending = False).head(n=n_head)['Sensitivity']
+        return self.df['Sensitivity'].iloc[self._top(n_head)]
         
     def ob(self, observation):
         '''Return the sensitivity of a single observation
@@ -113,15 +141,10 @@ class ObSen:
                 n_head = len(self.df.index)
             else:
                 n_head = n
-            if n_head > 0:                        
-                obs = self.df.sort(columns = 'Sensitivity', ascending = False).head(n=n_head)['Sensitivity'].index
-                sensitivity = self.df.sort(columns = 'Sensitivity', ascending = False).head(n=n_head)['Sensitivity'].values
-                ob_groups = self.df.sort(columns = 'Sensitivity', ascending = False).head(n=n_head)['Ob Groups'].values
-            if n_head < 0:
-                n_head = abs(n_head)
-                obs = self.df.sort(columns = 'Sensitivity', ascending = False).tail(n=n_head)['Sensitivity'].index
-                sensitivity = self.df.sort(columns = 'Sensitivity', ascending = False).tail(n=n_head)['Sensitivity'].values 
-                ob_groups = self.df.sort(columns = 'Sensitivity', ascending = False).tail(n=n_head)['Ob Groups'].values
+            ranked = self.df.iloc[self._top(n_head)]
+            obs = ranked.index
+            sensitivity = ranked['Sensitivity'].values
+            ob_groups = ranked['Ob Groups'].values
     
             # Asign colors for each group
             color_map = plt.get_cmap('Spectral')
@@ -148,13 +171,9 @@ class ObSen:
                 n_head = len(self.df.index)
             else:
                 n_head = n
-            if n_head > 0:                       
-                obs = self.df.sort(columns = 'Sensitivity', ascending = False).ix[self.df['Ob Groups'] == group, 'Sensitivity'].head(n=n_head).index
-                sensitivity = self.df.sort(columns = 'Sensitivity', ascending = False).ix[self.df['Ob Groups'] == group, 'Sensitivity'].head(n=n_head).values          
-            if n_head < 0:
-                n_head = abs(n_head)            
-                obs = self.df.sort(columns = 'Sensitivity', ascending = False).ix[self.df['Ob Groups'] == group, 'Sensitivity'].tail(n=n_head).index
-                sensitivity = self.df.sort(columns = 'Sensitivity', ascending = False).ix[self.df['Ob Groups'] == group, 'Sensitivity'].tail(n=n_head).values                  
+            ranked = self.df.iloc[self._top(n_head, group)]
+            obs = ranked.index
+            sensitivity = ranked['Sensitivity'].values
             plt.barh(np.arange(len(obs)), sensitivity, align = 'center')
             plt.yticks(np.arange(len(obs)), obs)
             plt.ylim(-1, len(obs))
@@ -4,22 +4,38 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
+from _rank import Ranked
+from _jco import is_sparse, jco_names, sparse_group_col_sumsq, \
+                 dense_group_col_sumsq, obs_arrays, par_arrays, keep_groups_mask
 
 
-class ParSen:
-    def __init__(self, jco_df, obs_dict, pars_dict, drop_regul = False, drop_groups = None, keep_groups = None):
+class ParSen(Ranked):
+    _group_column = 'Parameter Group'
+    
+    def __init__(self, jco_df, obs_dict, pars_dict = None, drop_regul = False, drop_groups = None, keep_groups = None,
+                 par_names = None, obs_names = None, chunk_size = None):
         ''' Create ParSen class
             
         Parameters
         ----------
-        jco_df : Pandas dataframe
-            Pandas data frame of the Jacobian returned from pest_tools.load_jco
+        jco_df : Pandas dataframe, numpy array or scipy.sparse matrix
+            Pandas data frame of the Jacobian returned from pest_tools.load_jco.
+            A memmap or sparse matrix from pest_tools.load_jco(..., memmap = True)
+            or (..., sparse = True), or an iterable of blocks of rows (arrays,
+            DataFrames or sparse matrices, in observation order) may be used,
+            in which case par_names and obs_names are required.  Blocks are
+            read once, so a generator reading a Jacobian that does not fit
+            in memory can be used
     
-        obs_dict: dict
-            Dictionary of the observations returned from pest_tools.load_obs
+        obs_dict: dict or Pst
+            Dictionary of the observations returned from pest_tools.load_obs,
+            or a pest_tools.Pst of the control file.  With a Pst the weights
+            and groups aligned with the Jacobian are built once and reused
+            by later ParSen, ObSen and Cor builds
                   
-        pars_dict: dict
-            Dictionary of the parameters returned from pest_tools.load_pars
+        pars_dict: dict, optional
+            Dictionary of the parameters returned from pest_tools.load_pars.
+            Not needed if obs_dict is a Pst
             
         drop_regul: {False, True}, optional
             Flag to drop regularization information in calculating parameter
@@ -35,7 +51,20 @@ class ParSen:
             List of observation groups to include in calculating parameter
             sensitivity.  Sometimes easier to use when looking at sensitivity
             to a single, or small number, or observation groups
-        
+            
+        par_names: list, optional
+            List of parameter names returned from pest_tools.load_jco.
+            Required if jco_df is not a DataFrame
+            
+        obs_names: list, optional
+            List of observation names returned from pest_tools.load_jco.
+            Required if jco_df is not a DataFrame
+
+        chunk_size: int, optional
+            Number of rows of a dense or memmapped jco_df read at a time,
+            which bounds the temporary memory used.  Default is about 256k
+            entries per block.  Blocks from an iterable are used as given
+
         Attributes
         ----------
         df : Pandas DataFrame 
@@ -50,55 +79,190 @@ class ParSen:
         with large jco
         
         '''                 
+        if pars_dict is None:
+            if not hasattr(obs_dict, 'par_arrays'):
+                raise ValueError('pars_dict from pest_tools.load_pars is required '
+                                 'unless obs_dict is a pest_tools.Pst')
+            pars_dict = obs_dict
+        par_names, obs_names = jco_names(jco_df, par_names, obs_names)
         
-        # Build weights array
-        weights = []
-        ob_groups = []
-        for ob in jco_df.index:
-            weight = float(obs_dict[ob][1])
-            ob_group = obs_dict[ob][2]
-            
-            # Set weights for regularization info to zero if drop_regul == True
-            if drop_regul == True and 'regul' in ob_group.lower():
-                weight = 0.0
-            
-            # Set weights for obs in drop_groups to zero
-            if drop_groups != None:
-                # set all groups in drop_groups to lower case
-                drop_groups = [item.lower() for item in drop_groups]
-                if ob_group.lower() in drop_groups:
-                    weight = 0.0
-            
-            # Set weights for obs not in keep_group to zero
-            if keep_groups != None:
-                # set all groups in keep_groups to lower case
-                keep_groups = [item.lower() for item in keep_groups]
-                if ob_group.lower() not in keep_groups:
-                    weight = 0.0
-                
-            weights.append(weight)
-            ob_groups.append(ob_group)
+        # Weights and groups of the observations
+        weights, ob_codes, ob_group_names = obs_arrays(obs_dict, obs_names)
         
-        # Get count of non-zero weights    
-        n_nonzero_weights = np.count_nonzero(weights)
+        # Squared column sums and count of non-zero weights of each 
+        # observation group, computed once.  Sensitivity for any group
+        # filter is then a combination of the rows of group_sumsq
+        if is_sparse(jco_df):
+            # Only touches the non-zero entries of the Jacobian
+            self._group_sumsq = sparse_group_col_sumsq(jco_df, weights, ob_codes, len(ob_group_names))
+        else:
+            self._group_sumsq = dense_group_col_sumsq(jco_df, weights, ob_codes, len(ob_group_names),
+                                                      chunk_size)
+        self._group_counts = np.bincount(ob_codes[weights != 0], minlength = len(ob_group_names))
+        self._ob_groups = ob_group_names
         
-        # Calculate sensitivities
-        sensitivities = []
-        for col in jco_df:
-            sen = np.linalg.norm(np.asarray(jco_df[col])*weights)/n_nonzero_weights
-            sensitivities.append(sen)    
+        # Calculate sensitivities, filters are applied once per group
+        self._keep = keep_groups_mask(ob_group_names, drop_regul, drop_groups, keep_groups)
+        sensitivities = self._sensitivity(self._keep[np.newaxis, :])[0]
         
         # Build Group Array
-        par_groups = []
-        for par in jco_df.columns:
-            par_group = pars_dict[par][5]
-            par_groups.append(par_group)
+        par_codes, par_group_names = par_arrays(pars_dict, par_names)
+        par_groups = par_group_names.values.take(par_codes)
         
         # Build pandas data frame of parameter sensitivities    
         sen_data = {'Sensitivity' : sensitivities, 'Parameter Group' : par_groups}
-        par_sen_df = pd.DataFrame(sen_data, index = jco_df.columns)
+        par_sen_df = pd.DataFrame(sen_data, index = par_names)
         self.df = par_sen_df
 
+    def _sensitivity(self, keep):
+        ''' Sensitivity of each parameter (columns) for each row of keep, a
+        boolean array of the observation groups included '''
+        keep = np.asarray(keep, dtype = np.float64)
+        # Get count of non-zero weights
+        n_nonzero_weights = np.dot(keep, self._group_counts)
+        return np.sqrt(np.dot(keep, self._group_sumsq))/n_nonzero_weights[:, np.newaxis]
+
+    def scenarios(self, scenarios = None):
+        ''' Parameter sensitivity for many observation group filters at once
+        
+        Parameters
+        ----------
+        scenarios : list or dict, optional
+            Each scenario is a dict of any of drop_regul, drop_groups and
+            keep_groups, as for ParSen.  Scenarios in a list are numbered, 
+            the keys of a dict (e.g. an OrderedDict) are used as the 
+            scenario names.  Default is all observations, then each 
+            observation group dropped, then each observation group alone
+            
+        Returns
+        -------
+        Pandas DataFrame
+            Sensitivity with one row per scenario and one column per 
+            parameter
+            
+        Notes
+        ------
+        Uses the squared column sums of each observation group computed
+        when the ParSen was created, so no scenario reads the Jacobian
+        again.  Each scenario costs O(groups x parameters).
+        
+        '''
+        if scenarios is None:
+            scenarios = [('all', {})]
+            scenarios += [('drop ' + group, {'drop_groups' : [group]}) for group in self._ob_groups]
+            scenarios += [('keep ' + group, {'keep_groups' : [group]}) for group in self._ob_groups]
+        elif isinstance(scenarios, dict):
+            scenarios = list(scenarios.items())
+        else:
+            scenarios = list(enumerate(scenarios))
+        keep = np.array([keep_groups_mask(self._ob_groups, **scenario) 
+                         for name, scenario in scenarios], dtype = bool)
+        keep = keep.reshape(len(scenarios), len(self._ob_groups))
+        return pd.DataFrame(self._sensitivity(keep), 
+                            index = [name for name, scenario in scenarios],
+                            columns = self.df.index)
+
+    def leave_group_out(self):
+        ''' Parameter sensitivity with each observation group left out
+        
+        Returns
+        -------
+        sensitivity : Pandas DataFrame
+            Sensitivity with one row per observation group, computed with
+            that group removed, and one column per parameter
+            
+        relative_change : Pandas DataFrame
+            Relative change of sensitivity from df when the group is
+            removed, (sensitivity - full)/full.  Large negative values 
+            show the observation groups that carry a parameter
+            
+        Notes
+        ------
+        The full set is the observations used for df, i.e. after 
+        drop_regul, drop_groups and keep_groups, and only groups in the 
+        full set get a row.  Built from the squared column sums of each 
+        observation group computed when the ParSen was created, so the 
+        Jacobian is not read again.
+        
+        '''
+        groups = np.flatnonzero(self._keep)
+        keep = np.repeat(self._keep[np.newaxis, :], len(groups), axis = 0)
+        keep[np.arange(len(groups)), groups] = False
+        sensitivity = pd.DataFrame(self._sensitivity(keep), 
+                                   index = self._ob_groups[groups],
+                                   columns = self.df.index)
+        full = self.df['Sensitivity'].values
+        relative_change = pd.DataFrame((sensitivity.values - full)/full,
+                                       index = sensitivity.index,
+                                       columns = sensitivity.columns)
+        return sensitivity, relative_change
+
+    def plot_leave_group_out(self, relative = True, n = None):
+        ''' Plot heat map of parameter sensitivity with each observation 
+        group left out
+        
+        Parameters
+        ----------
+        relative: {True, False}, optional
+            If True (default) plot the relative change from the full set,
+            else plot the sensitivity
+            
+        n: {None, int}, optional
+            If None then plot all parameters, else plot the n most 
+            sensitive parameters
+            
+        Returns
+        -------
+        Matplotlib plot
+            Image of observation group x parameter with color flood
+        '''
+        sensitivity, relative_change = self.leave_group_out()
+        if relative == True:
+            data = relative_change
+            label = 'Relative change in sensitivity'
+        else:
+            data = sensitivity
+            label = 'Parameter sensitivity'
+        if n != None:
+            data = data.iloc[:, self._top(n)]
+        pars = data.columns.values
+        groups = data.index.values
+        array = data.values
+        
+        # Make figure
+        plt.figure()
+        ax = plt.gca()
+        if relative == True:
+            # Diverging colors centered on no change
+            limit = np.nanmax(np.abs(array)) if array.size > 0 else 1.0
+            image = ax.imshow(array, interpolation = 'none', aspect = 'auto',
+                              cmap = plt.get_cmap('RdBu'), vmin = -limit, vmax = limit)
+        else:
+            image = ax.imshow(array, interpolation = 'none', aspect = 'auto')
+        
+        # Set ticks, parameter labels only if they can be read
+        plt.yticks(np.arange(len(groups)), groups)
+        if len(pars) <= 100:
+            ax.xaxis.set_ticks_position('top')
+            plt.xticks(np.arange(len(pars)), pars, rotation = 90)
+        plt.ylabel('Observation Group Left Out')
+        
+        # Set up so par, group and value show in lower left as mouse moved
+        def _format_coord(x, y):
+            x = int(x + 0.5)
+            y = int(y + 0.5)
+            try:
+                return "%.3f %s | %s" % (array[y, x], groups[y], pars[x])
+            except IndexError:
+                return ""
+        ax.format_coord = _format_coord
+        
+        # Add colorbar
+        plt.colorbar(image, label = label)
+        
+        plt.draw()
+        plt.tight_layout()
+
     def tail(self, n_tail):
         ''' Get the lest sensitive parameters
         Parameters
@@ -112,7 +276,7 @@ class ParSen:
             Series of n_tail least sensitive parameters
                 
         '''
-        return self.df.sort(columns = 'Sensitivity', ascending = False).tail(n=n_tail)['Sensitivity']
+        return self.df['Sensitivity'].iloc[self._top(-n_tail)]
         
     def head(self, n_head):
         ''' Get the most sensitive parameters
@@ -126,7 +290,7 @@ class ParSen:
         pandas Series
             Series of n_head most sensitive parameters
         '''
-        return self.df.sort(columns = 'Sensitivity', ascending = False).head(n=n_head)['Sensitivity']
+        return self.df['Sensitivity'].iloc[self._top(n_head)]
 
     def par(self, parameter):
         '''Return the sensitivity of a single parameter
@@ -167,15 +331,8 @@ class ParSen:
         else:
             n_head = n
         
-        if n_head > 0:            
-            #pars = self.df.sort(columns = 'Sensitivity', ascending = False).ix[self.df['Parameter Group'] == group, 'Sensitivity'].head(n=n_head).index
-            #sensitivity = self.df.sort(columns = 'Sensitivity', ascending = False).ix[self.df['Parameter Group'] == group, 'Sensitivity'].head(n=n_head)
-            sensitivity = self.df.sort(columns = 'Sensitivity', ascending = False).ix[self.df['Parameter Group'] == group].head(n=n_head)
-        if n_head < 0:
-            n_head = abs(n_head)            
-            #pars = self.df.sort(columns = 'Sensitivity', ascending = False).ix[self.df['Parameter Group'] == group, 'Sensitivity'].tail(n=n_head).index
-            #sensitivity = self.df.sort(columns = 'Sensitivity', ascending = False).ix[self.df['Parameter Group'] == group, 'Sensitivity'].tail(n=n_head)
-            sensitivity = self.df.sort(columns = 'Sensitivity', ascending = False).ix[self.df['Parameter Group'] == group].tail(n=n_head)
+        # n_head > 0 most sensitive, n_head < 0 least sensitive
+        sensitivity = self.df.iloc[self._top(n_head, group)]
             
         sensitivity.index.name = 'Parameter'
         return sensitivity
@@ -216,15 +373,10 @@ class ParSen:
                 n_head = len(self.df.index)
             else:
                 n_head = n
-            if n_head > 0:                        
-                pars = self.df.sort(columns = 'Sensitivity', ascending = False).head(n=n_head)['Sensitivity'].index
-                sensitivity = self.df.sort(columns = 'Sensitivity', ascending = False).head(n=n_head)['Sensitivity'].values
-                par_groups = self.df.sort(columns = 'Sensitivity', ascending = False).head(n=n_head)['Parameter Group'].values
-            if n_head < 0:
-                n_head = abs(n_head)
-                pars = self.df.sort(columns = 'Sensitivity', ascending = False).tail(n=n_head)['Sensitivity'].index
-                sensitivity = self.df.sort(columns = 'Sensitivity', ascending = False).tail(n=n_head)['Sensitivity'].values
-                par_groups = self.df.sort(columns = 'Sensitivity', ascending = False).tail(n=n_head)['Parameter Group'].values            
+            ranked = self.df.iloc[self._top(n_head)]
+            pars = ranked.index
+            sensitivity = ranked['Sensitivity'].values
+            par_groups = ranked['Parameter Group'].values
     
             # Assign colors for each group
             color_map = plt.get_cmap('Spectral')
@@ -252,13 +404,9 @@ class ParSen:
             else:
                 n_head = n
             
-            if n_head > 0:            
-                pars = self.df.sort(columns = 'Sensitivity', ascending = False).ix[self.df['Parameter Group'] == group, 'Sensitivity'].head(n=n_head).index
-                sensitivity = self.df.sort(columns = 'Sensitivity', ascending = False).ix[self.df['Parameter Group'] == group, 'Sensitivity'].head(n=n_head).values          
-            if n_head < 0:
-                n_head = abs(n_head)            
-                pars = self.df.sort(columns = 'Sensitivity', ascending = False).ix[self.df['Parameter Group'] == group, 'Sensitivity'].tail(n=n_head).index
-                sensitivity = self.df.sort(columns = 'Sensitivity', ascending = False).ix[self.df['Parameter Group'] == group, 'Sensitivity'].tail(n=n_head).values                      
+            ranked = self.df.iloc[self._top(n_head, group)]
+            pars = ranked.index
+            sensitivity = ranked['Sensitivity'].values
             
             plt.barh(np.arange(len(pars)), sensitivity, align = 'center')
             plt.yticks(np.arange(len(pars)), pars)
@@ -0,0 +1,660 @@
+import numpy as np
+import pandas as pd
+
+# Column names of the parsed sections, as named in the PEST manual
+_par_group_columns = ['inctyp', 'derinc', 'derinclb', 'forcen', 'derincmul',
+                      'dermthd', 'splitthresh', 'splitreldiff', 'splitaction']
+_par_group_floats = ['derinc', 'derinclb', 'derincmul', 'splitthresh',
+                     'splitreldiff']
+_par_data_columns = ['partrans', 'parchglim', 'parval1', 'parlbnd', 'parubnd',
+                     'pargp', 'scale', 'offset', 'dercom']
+_par_data_floats = ['parval1', 'parlbnd', 'parubnd', 'scale', 'offset']
+_par_data_categories = ['partrans', 'parchglim', 'pargp']
+
+# Sections parsed into DataFrames, all others are kept as lines of text
+_parsed_sections = ['parameter groups', 'parameter data', 'observation groups',
+                    'observation data', 'prior information']
+
+def _to_float(values):
+    ''' Convert a sequence of strings to a float64 array '''
+    try:
+        return np.array(values, dtype = np.float64)
+    except ValueError:
+        # Fortran double precision exponents, e.g. 1.0d+00
+        return np.array([value.replace('d', 'e') for value in values],
+                        dtype = np.float64)
+
+def _rows(text, lower = True):
+    ''' Split the text of a section into rows of tokens, skipping blank lines '''
+    if lower == True:
+        text = text.lower()
+    return [tokens for tokens in [line.split() for line in text.splitlines()]
+            if len(tokens) > 0]
+
+def _read_obs_data(text):
+    ''' Parse the text of the observation data section into a DataFrame '''
+    return _obs_chunk(_obs_columns(text))
+
+def _columns(rows, n):
+    ''' Transpose rows of tokens into n columns, padding short rows with None '''
+    if len(rows) == 0:
+        return [()] * n
+    padded = [row + [None] * (n - len(row)) if len(row) < n else row[:n]
+              for row in rows]
+    return list(zip(*padded))
+
+def _tokens_per_line(text, n_lines):
+    ''' Number of whitespace separated tokens on each line of text,
+    counted over its bytes with numpy rather than line by line '''
+    chars = np.frombuffer(text, dtype = np.uint8)
+    # Space, tab, newline, carriage return and other control characters
+    space = chars <= 32
+    # A token starts at a non-space character after a space or at the start
+    starts = np.empty(len(chars) + 1, dtype = np.int32)
+    starts[0] = 0
+    starts[1] = not space[0] if len(chars) > 0 else 0
+    np.greater(space[:-1], space[1:], out = starts[2:])
+    np.cumsum(starts, out = starts)
+    # Tokens started before the end of each line
+    ends = np.flatnonzero(chars == 10) + 1
+    if len(ends) < n_lines:
+        ends = np.append(ends, len(chars))
+    return np.diff(np.concatenate(([0], starts[ends])))
+
+def _obs_columns(text):
+    ''' Split the text of observation data lines into name, value, weight
+    and group columns '''
+    text = text.lower()
+    tokens = text.split()
+    n_lines = text.count('\n')
+    if not text.endswith('\n'):
+        n_lines += 1
+    if (len(tokens) == 4 * n_lines
+        and (_tokens_per_line(text, n_lines) == 4).all()):
+        # Every line is obsnme obsval weight obgnme, so the columns can be 
+        # sliced from a single split of the whole section.  Anything else,
+        # including blank lines, is split line by line
+        return [tokens[i::4] for i in range(4)]
+    return _columns(_rows(text, lower = False), 4)
+
+def _obs_blocks(f, chunk_size, prior_info):
+    ''' Yield columns of up to chunk_size observations, then of prior 
+    information equations, from the open control file f '''
+    section = None
+    lines = []
+    prior_rows = []
+    for line in f:
+        if line.startswith('*'):
+            if section == 'observation data':
+                if len(lines) > 0:
+                    yield _obs_columns(''.join(lines))
+                    lines = []
+                if prior_info == False:
+                    return
+            if section == 'prior information':
+                break
+            section = line[1:].strip().lower()
+        elif section == 'observation data':
+            lines.append(line)
+            if len(lines) == chunk_size:
+                yield _obs_columns(''.join(lines))
+                lines = []
+        elif section == 'prior information':
+            tokens = line.lower().split()
+            if len(tokens) == 0:
+                continue
+            if tokens[0] == '&':
+                # Continuation of the previous prior information equation
+                prior_rows[-1].extend(tokens[1:])
+                continue
+            if len(prior_rows) == chunk_size:
+                yield _prior_columns(prior_rows)
+                prior_rows = []
+            prior_rows.append(tokens)
+    if len(lines) > 0:
+        yield _obs_columns(''.join(lines))
+    if len(prior_rows) > 0:
+        yield _prior_columns(prior_rows)
+
+def _prior_columns(prior_rows):
+    ''' pilbl, pival, weight and obgnme columns of prior information rows '''
+    return [[row[0] for row in prior_rows], [row[-3] for row in prior_rows],
+            [row[-2] for row in prior_rows], [row[-1] for row in prior_rows]]
+
+def _obs_chunk(columns):
+    ''' DataFrame of name, value, weight and group columns '''
+    obs_df = pd.DataFrame({'obsval' : _to_float(columns[1]),
+                           'weight' : _to_float(columns[2]),
+                           'obgnme' : pd.Categorical(list(columns[3]))},
+                          index = list(columns[0]),
+                          columns = ['obsval', 'weight', 'obgnme'])
+    obs_df.index.name = 'obsnme'
+    return obs_df
+
+def iter_pst_obs(pst_file, chunk_size = 100000, groups = None, prior_info = True):
+    ''' Stream observation data and prior information from a PEST control 
+    file in fixed size chunks
+
+    Parameters
+    ----------
+    pst_file : string
+        File name for PEST control file
+
+    chunk_size : int, optional
+        Maximum number of observations in each chunk.  Default is 100000
+
+    groups : list, optional
+        Observation groups to keep.  Observations in other groups are
+        skipped while parsing.  Default is all groups
+
+    prior_info : {True, False}, optional
+        If True (default) prior information equations follow the
+        observations, with pival in the obsval column
+
+    Yields
+    ------
+    obs_df : Pandas DataFrame
+        Up to chunk_size observations.  Index is obsnme (pilbl for prior
+        information), columns are obsval, weight and obgnme, the same
+        values as pest_tools.load_obs
+
+    Notes
+    ------
+    Only one chunk of observations is held in memory at a time, so per
+    group summaries of files with millions of observations can be built
+    with bounded memory, e.g.
+
+    >>> weights = [chunk.groupby('obgnme')['weight'].sum()
+    ...            for chunk in iter_pst_obs('case.pst')]
+    >>> weights = pd.concat(weights).groupby(level = 0).sum()
+
+    Reading stops at the end of the prior information section (or of the 
+    observation data section if prior_info = False).
+
+    '''
+    if groups is not None:
+        groups = set([group.lower() for group in groups])
+    f = open(pst_file, 'r')
+    try:
+        for columns in _obs_blocks(f, chunk_size, prior_info):
+            if groups is not None:
+                # Drop other groups before converting values to float
+                keep = [i for i, group in enumerate(columns[3]) if group in groups]
+                if len(keep) == 0:
+                    continue
+                if len(keep) < len(columns[3]):
+                    columns = [[column[i] for i in keep] for column in columns]
+            yield _obs_chunk(columns)
+    finally:
+        f.close()
+
+# Number of table rows formatted and written at a time
+_write_rows = 100000
+
+def _write_table(f, fmt, columns):
+    ''' Write rows of columns to f formatted with fmt, a block at a time '''
+    n = len(columns[0]) if len(columns) > 0 else 0
+    for start in range(0, n, _write_rows):
+        rows = zip(*[column[start:start + _write_rows] for column in columns])
+        f.write(''.join([fmt % row for row in rows]))
+
+def _write_tokens(f, rows):
+    ''' Write rows of tokens of varying length, skipping missing entries '''
+    f.write(''.join([' '.join([token for token in row if token is not None])
+                     + '\n' for row in rows]))
+
+def _float_strings(values):
+    ''' Shortest strings that read back as exactly the same float64 values '''
+    values = np.asarray(values, dtype = np.float64)
+    # Format each distinct value once with repr, str and older numpy keep
+    # only 12 significant digits under Python 2
+    unique, inverse = np.unique(values, return_inverse = True)
+    strings = np.array([repr(float(value)) for value in unique], dtype = object)
+    return strings[inverse].tolist()
+
+def _strings(values):
+    ''' Strings of a column, None for missing entries '''
+    return [None if pd.isnull(value) else str(value) for value in values]
+
+def _category_strings(values):
+    ''' Strings of a Categorical column, looked up once per category '''
+    categories = np.array([str(category) for category in values.categories],
+                          dtype = object)
+    return categories[values.codes].tolist()
+
+def load_par_file(par_file):
+    ''' Read parameter values from a PEST .par file
+
+    Parameters
+    ----------
+    par_file : string
+        File name for .par file written by PEST
+
+    Returns
+    -------
+    parval : Pandas Series
+        Parameter values indexed by (lower case) parameter name
+
+    '''
+    f = open(par_file, 'r')
+    # First line is the precision and decimal point setting
+    f.readline()
+    rows = _rows(f.read())
+    f.close()
+    columns = _columns(rows, 2)
+    parval = pd.Series(_to_float(columns[1]), index = list(columns[0]))
+    parval.index.name = 'parnme'
+    return parval
+
+class Pst:
+    def __init__(self, pst_file):
+        ''' Create Pst class, a single pass parse of a PEST control file
+
+        Parameters
+        ----------
+        pst_file : str
+            File name for PEST control file
+
+        Attributes
+        ----------
+        control : dict
+            Dimensions from the control data section: npar, nobs, npargp,
+            nprior and nobsgp
+
+        par_groups : Pandas DataFrame
+            Parameter groups.  Index is pargpnme, columns are inctyp,
+            derinc, derinclb, forcen, derincmul, dermthd and, if present,
+            splitthresh, splitreldiff and splitaction
+
+        par_data : Pandas DataFrame
+            Parameter data.  Index is parnme, columns are partrans,
+            parchglim, parval1, parlbnd, parubnd, pargp, scale, offset and
+            dercom
+
+        tied : Pandas Series
+            Parent parameter (partied) of each tied parameter
+
+        obs_groups : Pandas DataFrame
+            Observation groups.  Index is obgnme, column covfile is the
+            covariance matrix file of the group (None if not given)
+
+        obs_data : Pandas DataFrame
+            Observation data.  Index is obsnme, columns are obsval, weight
+            and obgnme
+
+        prior_info : Pandas DataFrame
+            Prior information.  Index is pilbl, columns are equation
+            (the text between pilbl and pival), pival, weight and obgnme
+
+        Notes
+        ------
+        The file is read once and split into sections at lines starting with
+        *.  The observation data section is split in a single call and its 
+        columns sliced from the tokens; other sections split each line once.
+        Numeric columns are float64 (dercom is int) and group and 
+        transformation columns are pandas Categoricals.  As with load_pars
+        and load_obs, names and groups are converted to lower case.  Sections other than those
+        listed above are kept as text.
+
+        A Pst may be passed to ParSen, ObSen and Cor in place of the 
+        dictionaries from load_obs and load_pars.  The positions of Jacobian
+        names in the tables are then looked up once by obs_arrays and
+        par_arrays and reused.
+
+        '''
+        f = open(pst_file, 'r')
+        text = f.read()
+        f.close()
+        
+        # Split the file into sections at lines starting with *
+        header_starts = []
+        if text.startswith('*'):
+            header_starts.append(0)
+        i = text.find('\n*')
+        while i != -1:
+            header_starts.append(i + 1)
+            i = text.find('\n*', i + 1)
+        header_ends = []
+        for start in header_starts:
+            end = text.find('\n', start)
+            if end == -1:
+                end = len(text)
+            header_ends.append(end)
+        sections = []
+        bodies = dict()
+        if len(header_starts) > 0:
+            sections.append((None, text[:header_starts[0]].splitlines()))
+        for k in range(len(header_starts)):
+            name = text[header_starts[k]:header_ends[k]].strip()
+            if k + 1 < len(header_starts):
+                body = text[header_ends[k] + 1:header_starts[k + 1]]
+            else:
+                body = text[header_ends[k] + 1:]
+            key = name[1:].strip().lower()
+            if key in _parsed_sections:
+                bodies[key] = body
+                sections.append((name, None))
+            else:
+                sections.append((name, body.splitlines()))
+        del(text)
+        self._sections = sections
+        
+        # Control data dimensions are on the third line of the section
+        self.control = dict()
+        for name, lines in sections:
+            if name is not None and name.lower() == '* control data':
+                counts = lines[1].split()
+                for key, value in zip(['npar', 'nobs', 'npargp', 'nprior',
+                                       'nobsgp'], counts):
+                    self.control[key] = int(value)
+                break
+
+        # Parameter groups
+        group_rows = _rows(bodies.get('parameter groups', ''))
+        n_columns = max([len(row) for row in group_rows] + [7]) - 1
+        columns = _columns(group_rows, n_columns + 1)
+        data = dict()
+        for name, values in zip(_par_group_columns[:n_columns], columns[1:]):
+            if name in _par_group_floats and None not in values:
+                data[name] = _to_float(values)
+            else:
+                data[name] = pd.Categorical(list(values))
+        self.par_groups = pd.DataFrame(data, index = list(columns[0]),
+                                       columns = _par_group_columns[:n_columns])
+        self.par_groups.index.name = 'pargpnme'
+
+        # Parameter data, tied parameter lines have two entries
+        par_rows = _rows(bodies.get('parameter data', ''))
+        tied_rows = [row for row in par_rows if len(row) == 2]
+        columns = _columns([row for row in par_rows if len(row) != 2], 10)
+        data = dict()
+        for name, values in zip(_par_data_columns, columns[1:]):
+            if name in _par_data_floats:
+                data[name] = _to_float(values)
+            elif name in _par_data_categories:
+                data[name] = pd.Categorical(list(values))
+            else:
+                data[name] = np.array([1 if value is None else int(value)
+                                       for value in values], dtype = int)
+        self.par_data = pd.DataFrame(data, index = list(columns[0]),
+                                     columns = _par_data_columns)
+        self.par_data.index.name = 'parnme'
+        columns = _columns(tied_rows, 2)
+        self.tied = pd.Series(list(columns[1]), index = list(columns[0]),
+                              dtype = object)
+        self.tied.index.name = 'parnme'
+
+        # Observation groups
+        # Keep case of covariance matrix file names
+        group_rows = _rows(bodies.get('observation groups', ''), lower = False)
+        columns = _columns([[row[0].lower()] + row[1:] for row in group_rows], 2)
+        self.obs_groups = pd.DataFrame({'covfile' : list(columns[1])},
+                                       index = list(columns[0]))
+        self.obs_groups.index.name = 'obgnme'
+
+        # Observation data
+        self.obs_data = _read_obs_data(bodies.get('observation data', ''))
+
+        # Prior information, last three entries are pival, weight and obgnme
+        prior_rows = []
+        for row in _rows(bodies.get('prior information', '')):
+            if row[0] == '&':
+                # Continuation of the previous prior information equation
+                prior_rows[-1].extend(row[1:])
+            else:
+                prior_rows.append(row)
+        self.prior_info = pd.DataFrame(
+            {'equation' : [' '.join(row[1:-3]) for row in prior_rows],
+             'pival' : _to_float([row[-3] for row in prior_rows]),
+             'weight' : _to_float([row[-2] for row in prior_rows]),
+             'obgnme' : pd.Categorical([row[-1] for row in prior_rows])},
+            index = [row[0] for row in prior_rows],
+            columns = ['equation', 'pival', 'weight', 'obgnme'])
+        self.prior_info.index.name = 'pilbl'
+
+        # Positions of the last Jacobian names of each kind in the tables, 
+        # see obs_arrays and par_arrays
+        self._obs_names = None
+        self._aligned = dict()
+
+    def _observations(self):
+        ''' Names of observations and prior information, in the order of
+        load_obs '''
+        obs_index = self.obs_data.index
+        prior_index = self.prior_info.index
+        # Rebuilt only when rows of either table are replaced
+        if (self._obs_names is None or self._obs_names[0] is not obs_index
+            or self._obs_names[1] is not prior_index):
+            names = pd.Index(list(obs_index) + list(prior_index))
+            if not names.is_unique:
+                raise ValueError('Observation and prior information names are '
+                                 'not unique')
+            self._obs_names = (obs_index, prior_index, names)
+        return self._obs_names[2]
+
+    def _positions(self, index, names, kind):
+        ''' Position of each of names in index, KeyError if any are missing.
+        Only the most recent names of each kind are memoized, for as long
+        as index is unchanged '''
+        names = tuple(names)
+        memo = self._aligned.get(kind)
+        if memo is None or memo[0] is not index or memo[1] != names:
+            positions = index.get_indexer(list(names))
+            if (positions < 0).any():
+                missing = [names[i] for i in np.flatnonzero(positions < 0)[:5]]
+                raise KeyError('%s names not in control file: %s'
+                               % (kind, ', '.join(missing)))
+            self._aligned[kind] = (index, names, positions)
+        return self._aligned[kind][2]
+
+    def obs_arrays(self, obs_names):
+        ''' Weights and groups of observations aligned with a Jacobian
+
+        Parameters
+        ----------
+        obs_names : list
+            Observation names in Jacobian row order, as returned from
+            pest_tools.load_jco.  Prior information labels may be included
+
+        Returns
+        -------
+        weights : numpy array
+            float64 weight of each observation
+
+        codes : numpy array
+            Position of the group of each observation in groups
+
+        groups : Pandas Index
+            Observation group names
+
+        Notes
+        ------
+        The positions of the most recent obs_names in obs_data and
+        prior_info are memoized, so repeated ParSen, ObSen and Cor builds
+        against the same Jacobian only look the names up once.  Weights and groups are taken from the
+        current tables on every call, so edits to obs_data and prior_info 
+        are always used.
+
+        '''
+        positions = self._positions(self._observations(), obs_names,
+                                    'Observation')
+        weights = np.concatenate([self.obs_data['weight'].values,
+                                  self.prior_info['weight'].values])
+        obs_groups = pd.Categorical(self.obs_data['obgnme'])
+        prior_groups = pd.Categorical(self.prior_info['obgnme'])
+        # Recode both tables onto the union of their categories
+        groups = pd.Index(obs_groups.categories).union(
+            pd.Index(prior_groups.categories))
+        codes = np.concatenate(
+            [groups.get_indexer(obs_groups.categories)[obs_groups.codes],
+             groups.get_indexer(prior_groups.categories)[prior_groups.codes]])
+        return weights[positions], codes[positions], groups
+
+    def par_arrays(self, par_names):
+        ''' Groups of parameters aligned with a Jacobian
+
+        Parameters
+        ----------
+        par_names : list
+            Parameter names in Jacobian column order, as returned from
+            pest_tools.load_jco
+
+        Returns
+        -------
+        codes : numpy array
+            Position of the group of each parameter in groups
+
+        groups : Pandas Index
+            Parameter group names
+
+        Notes
+        ------
+        Positions are memoized on par_names as for obs_arrays, groups are 
+        taken from the current par_data.
+
+        '''
+        positions = self._positions(self.par_data.index, par_names,
+                                    'Parameter')
+        groups = pd.Categorical(self.par_data['pargp'])
+        return groups.codes[positions], pd.Index(groups.categories)
+
+    def scale_weights(self, factors):
+        ''' Multiply the weights of observation groups by a factor
+
+        Parameters
+        ----------
+        factors : dict or Pandas Series
+            Factor for each observation group, keyed by group name.  Groups
+            not listed keep their weights.  Applies to observations and
+            prior information
+
+        '''
+        factors = pd.Series(factors, dtype = np.float64)
+        factors.index = [str(group).lower() for group in factors.index]
+        for table in [self.obs_data, self.prior_info]:
+            groups = table['obgnme'].values
+            # One factor per category, applied to all rows through the codes
+            by_code = factors.reindex(groups.categories).fillna(1.0).values
+            if len(by_code) > 0:
+                table['weight'] = table['weight'].values * by_code[groups.codes]
+
+    def set_parval1(self, values):
+        ''' Set initial parameter values
+
+        Parameters
+        ----------
+        values : Pandas Series, numpy array, list or str
+            New parval1.  A Series is matched on parameter name and only
+            updates the parameters it lists.  An array or list must have a
+            value for every parameter in the order of par_data.  A string is
+            read as a PEST .par file, e.g. from a previous PEST run
+
+        '''
+        if isinstance(values, basestring):
+            values = load_par_file(values)
+        if isinstance(values, pd.Series):
+            names = [str(name).lower() for name in values.index]
+            positions = self.par_data.index.get_indexer(names)
+            if (positions < 0).any():
+                missing = [names[i] for i in np.flatnonzero(positions < 0)[:5]]
+                raise KeyError('Parameter names not in control file: %s'
+                               % (', '.join(missing)))
+            parval1 = self.par_data['parval1'].values.copy()
+            parval1[positions] = np.asarray(values.values, dtype = np.float64)
+        else:
+            parval1 = np.asarray(values, dtype = np.float64)
+            if parval1.shape != (len(self.par_data),):
+                raise ValueError('Expected %d parameter values, got %s'
+                                 % (len(self.par_data), parval1.shape))
+        self.par_data['parval1'] = parval1
+
+    def write(self, pst_file):
+        ''' Write the control file
+
+        Parameters
+        ----------
+        pst_file : string
+            File name for PEST control file
+
+        Notes
+        ------
+        Sections parsed into DataFrames are written from the current tables,
+        one line per row with space separated entries, so edits to
+        par_groups, par_data, tied, obs_groups, obs_data and prior_info
+        (e.g. by scale_weights and set_parval1) are written.  Floats are
+        written with repr, the shortest representation that reads back as
+        exactly the same value, so full precision .par values are kept.
+        The counts in the control data section are updated
+        to the table lengths.  All other sections are written as read.
+        Rows are formatted and written in blocks, so a 500,000 observation 
+        file is written in well under a second.
+
+        '''
+        f = open(pst_file, 'w')
+        try:
+            for name, lines in self._sections:
+                if name is not None:
+                    f.write(name + '\n')
+                if lines is None:
+                    self._write_section(f, name[1:].strip().lower())
+                    continue
+                if name is not None and name.lower() == '* control data':
+                    lines = list(lines)
+                    counts = lines[1].split()
+                    for i, key in enumerate(['npar', 'nobs', 'npargp', 
+                                             'nprior', 'nobsgp'][:len(counts)]):
+                        self.control[key] = len(self._table(key))
+                        counts[i] = str(self.control[key])
+                    lines[1] = ' '.join(['%7s' % (count) for count in counts])
+                f.write(''.join([line + '\n' for line in lines]))
+        finally:
+            f.close()
+
+    def _table(self, count):
+        ''' Table counted by a control data dimension '''
+        return {'npar' : self.par_data, 'nobs' : self.obs_data, 
+                'npargp' : self.par_groups, 'nprior' : self.prior_info,
+                'nobsgp' : self.obs_groups}[count]
+
+    def _write_section(self, f, key):
+        ''' Write the table of a parsed section '''
+        if key == 'parameter groups':
+            df = self.par_groups
+            columns = [list(df.index)]
+            for name in df.columns:
+                if name in _par_group_floats and df[name].dtype == np.float64:
+                    columns.append(_float_strings(df[name].values))
+                else:
+                    columns.append(_strings(df[name].values))
+            _write_tokens(f, zip(*columns))
+        elif key == 'parameter data':
+            df = self.par_data
+            columns = [list(df.index)]
+            for name in _par_data_columns:
+                if name in _par_data_floats:
+                    columns.append(_float_strings(df[name].values))
+                elif name in _par_data_categories:
+                    columns.append(_category_strings(df[name].values))
+                else:
+                    columns.append([str(value) for value in df[name].values])
+            _write_table(f, '%-12s %-8s %-8s %s %s %s %-12s %s %s %s\n',
+                         columns)
+            _write_table(f, '%-12s %s\n', [list(self.tied.index),
+                                           list(self.tied.values)])
+        elif key == 'observation groups':
+            columns = [list(self.obs_groups.index),
+                       _strings(self.obs_groups['covfile'].values)]
+            _write_tokens(f, zip(*columns))
+        elif key == 'observation data':
+            df = self.obs_data
+            _write_table(f, '%-20s %s %s %s\n',
+                         [list(df.index), _float_strings(df['obsval'].values),
+                          _float_strings(df['weight'].values),
+                          _category_strings(df['obgnme'].values)])
+        elif key == 'prior information':
+            df = self.prior_info
+            _write_table(f, '%-12s %s %s %s %s\n',
+                         [list(df.index), list(df['equation'].values),
+                          _float_strings(df['pival'].values),
+                          _float_strings(df['weight'].values),
+                          _category_strings(df['obgnme'].values)])
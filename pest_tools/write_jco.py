@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+import struct
+
+from load_jco import _record_dtype, _read_header
+from _jco import canonical_csc, is_sparse
+
+# Number of columns converted to records at a time for dense Jacobians
+_chunk_values = 1000000
+
+def _pack_names(names, width, kind):
+    ''' Space padded fixed width name table '''
+    names = [str(name) for name in names]
+    too_long = [name for name in names if len(name) > width]
+    if len(too_long) > 0:
+        raise ValueError('%s name %s is longer than %d characters'
+                         % (kind, too_long[0], width))
+    return ''.join(['%-*s' % (width, name) for name in names])
+
+def _read_trailer(file_name):
+    ''' Data after the name tables of a .jco, as written by PEST '''
+    f = open(file_name, 'rb')
+    try:
+        npar, nobs, count = _read_header(f)
+        f.seek(12 + count * _record_dtype.itemsize + npar * 12 + nobs * 20)
+        return f.read()
+    finally:
+        f.close()
+
+def write_jco(jco_df, file_name, par_names = None, obs_names = None,
+              trailer_from = None):
+    '''Write a Jacobian to a PEST Jacobian matrix file (binary)
+
+    Parameters
+    ----------
+    jco_df : Pandas DataFrame, numpy array or scipy.sparse matrix
+        Jacobian with observations as rows and parameters as columns, e.g.
+        as returned from pest_tools.load_jco
+
+    file_name : string
+        File name for the .jco (or .jcb, which uses the same layout)
+
+    par_names : list, optional
+        List of parameter names.  Default is the columns of jco_df.
+        Required if jco_df is not a DataFrame
+
+    obs_names : list, optional
+        List of observation names.  Default is the index of jco_df.
+        Required if jco_df is not a DataFrame
+
+    trailer_from : string, optional
+        File name of a .jco, usually the one jco_df was loaded from, whose
+        data after the name tables is copied to the end of the file.  PEST
+        writes run data there that load_jco does not read.  Default is to
+        end the file after the name tables
+
+    Notes
+    ------
+    Writes the layout read by pest_tools.load_jco: a header of -npar, -nobs
+    and the number of records, the records as packed (int32 1-based
+    column-major index, float64 value) pairs, then the 12 character
+    parameter and 20 character observation name tables padded with spaces.
+
+    Only non-zero entries of dense Jacobians are written.  For sparse
+    matrices every stored entry is written, so a .jco loaded with
+    load_jco(..., sparse = True) and written back with trailer_from set to
+    the original file is identical byte for byte (names aside, see
+    below), e.g.
+
+    >>> x, par_names, obs_names = load_jco('case.jco', sparse = True)
+    >>> write_jco(x, 'copy.jco', par_names, obs_names,
+    ...           trailer_from = 'case.jco')
+
+    load_jco returns names in lower case, so names in upper case in the
+    original are written in lower case.  Records are built and written
+    with array I/O a block of columns at a time.
+
+    '''
+    if isinstance(jco_df, pd.DataFrame):
+        if par_names is None:
+            par_names = list(jco_df.columns)
+        if obs_names is None:
+            obs_names = list(jco_df.index)
+        x = jco_df.values
+    else:
+        if par_names is None or obs_names is None:
+            raise ValueError('par_names and obs_names are required when the '
+                             'Jacobian is not a pandas DataFrame')
+        x = jco_df
+    nobs, npar = x.shape
+    if (nobs, npar) != (len(obs_names), len(par_names)):
+        raise ValueError('Jacobian shape %s does not match %d observation '
+                         'and %d parameter names'
+                         % ((nobs, npar), len(obs_names), len(par_names)))
+    if nobs * npar >= 2**31:
+        raise ValueError('Jacobian has too many entries for a .jco index')
+    par_table = _pack_names(par_names, 12, 'Parameter')
+    obs_table = _pack_names(obs_names, 20, 'Observation')
+    # Read before file_name is opened, which may be the same file
+    trailer = _read_trailer(trailer_from) if trailer_from is not None else ''
+
+    f = open(file_name, 'wb')
+    try:
+        if is_sparse(x):
+            x = canonical_csc(x)
+            cols = np.repeat(np.arange(npar), np.diff(x.indptr))
+            records = np.empty(x.nnz, dtype = _record_dtype)
+            records['index'] = cols * nobs + x.indices + 1
+            records['value'] = x.data
+            f.write(struct.pack('iii', -npar, -nobs, len(records)))
+            records.tofile(f)
+        else:
+            x = np.asarray(x)
+            # Count is needed for the header, so write a placeholder and
+            # fill it in once all blocks of records are written
+            f.write(struct.pack('iii', -npar, -nobs, 0))
+            count = 0
+            width = max(1, _chunk_values // max(nobs, 1))
+            for start in range(0, npar, width):
+                # Transpose so the block is ordered column-major
+                block = np.ascontiguousarray(x[:, start:start + width].T)
+                j = np.flatnonzero(block)
+                records = np.empty(len(j), dtype = _record_dtype)
+                records['index'] = start * nobs + j + 1
+                records['value'] = block.ravel()[j]
+                records.tofile(f)
+                count += len(records)
+            f.seek(8)
+            f.write(struct.pack('i', count))
+            f.seek(0, 2)
+        f.write(par_table)
+        f.write(obs_table)
+        f.write(trailer)
+    finally:
+        f.close()